@@ -1,6 +1,24 @@
-from db.init import init_db
+import asyncio
+from db.init import create_schema, seed_db, async_engine
+from scripts.migrate_schema import migrate_schema
+from scripts.convert_plan_id_column import convert_column
+from scripts.add_indexes import add_indexes
+
+def upgrade_schema():
+    # Each step is idempotent; create_all has already built any missing tables
+    migrate_schema()
+    convert_column()
+    add_indexes()
+
+async def main():
+    await create_schema()
+    # Existing databases must match the models before seeding writes to them
+    await asyncio.to_thread(upgrade_schema)
+    await seed_db()
+    # Close pooled connections while the loop is still running
+    await async_engine.dispose()
 
 if __name__ == "__main__":
     print("Initializing database...")
-    init_db()
+    asyncio.run(main())
     print("Database initialized successfully.")
@@ -1,18 +1,17 @@
 from sqlalchemy.orm import Session
-from db.init import get_db, engine
+from db.init import SessionLocal, engine
 from models.user import Customer
 from utils.square_client import get_customer_invoices
 import os
 
 def debug_invoices():
-    db = next(get_db())
+    db = SessionLocal()
     # Fetch all customers with a square_customer_id
     customers = db.query(Customer).filter(Customer.square_customer_id != None).all()
     
     # Test 2: Broad Search (Check if *any* invoices exist in the account)
     print("\nTest 2: Broad Search for ANY invoices in account...")
-    from utils.square_client import get_square_base_url, get_square_headers, SQUARE_LOCATION_ID
-    import requests
+    from utils.square_client import get_square_base_url, get_square_headers, square_session, SQUARE_LOCATION_ID
     
     url = f"{get_square_base_url()}/v2/invoices?limit=5"
     if SQUARE_LOCATION_ID:
@@ -20,7 +19,7 @@ def debug_invoices():
 
     headers = get_square_headers()
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = square_session.get(url, headers=headers, timeout=10)
         data = response.json()
         
         if response.status_code == 200:
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from db.init import init_db
 from dotenv import load_dotenv
 import os
@@ -15,20 +16,12 @@ load_dotenv()
 
 from routers import auth, payment, admin, webhooks
 
-app = FastAPI(title="Adams Property Care Backend")
-
-# Add request logging middleware
-@app.middleware("http")
-async def log_requests(request, call_next):
-    logger = logging.getLogger(__name__)
-    logger.info(f"{request.method} {request.url.path}")
-    response = await call_next(request)
-    logger.info(f"{request.method} {request.url.path} - Status: {response.status_code}")
-    return response
+# Request lines are logged by uvicorn's access log; no per-request middleware here
+app = FastAPI(title="Adams Property Care Backend", default_response_class=ORJSONResponse)
 
 @app.on_event("startup")
-def startup_event():
-    init_db()
+async def startup_event():
+    await init_db()
 
 # Configure CORS
 origins = [
@@ -1,2 +1,2 @@
 from models.user import Customer, Admin
-from models.subscription import SubscriptionPlan, Payment, PaymentMethod, SubscriptionLog, Invoice
+from models.subscription import SubscriptionPlan, Payment, PaymentMethod, SubscriptionLog, Invoice, WebhookEvent
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, TIMESTAMP, text, ForeignKey, Date, Boolean
+from sqlalchemy import Column, Integer, String, Float, TIMESTAMP, text, ForeignKey, Date, Boolean, Index, func, Text
+from sqlalchemy.orm import relationship
 from db.init import Base
 
 class SubscriptionPlan(Base):
@@ -6,7 +7,7 @@ class SubscriptionPlan(Base):
     id = Column(Integer, primary_key=True, index=True)
     plan_name = Column(String(100))
     plan_cost = Column(Float)
-    plan_variation_id = Column(String(255)) # Square Variation ID
+    plan_variation_id = Column(String(255), index=True) # Square Variation ID
     plan_description = Column(String(500))
 
 class Payment(Base):
@@ -21,7 +22,7 @@ class Payment(Base):
 class PaymentMethod(Base):
     __tablename__ = "payment_methods"
     id = Column(Integer, primary_key=True, index=True)
-    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
     square_card_id = Column(String(255), nullable=False)
     last_4_digits = Column(String(4), nullable=False)
     card_brand = Column(String(50))
@@ -35,8 +36,8 @@ class SubscriptionLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
     subscription_id = Column(String(255), nullable=True)
-    action = Column(String(50), nullable=False) # "PAUSE", "RESUME", "CANCEL", "ACTIVATE"
-    effective_date = Column(Date, nullable=True)
+    action = Column(String(50), nullable=False) # "PAUSE", "RESUME", "CANCEL", "ACTIVATE", "CHANGE_PENDING", "CHANGE_FAILED", "CHANGE_APPLIED"
+    effective_date = Column(Date, nullable=True, server_default=func.current_date())
     created_at = Column(TIMESTAMP, server_default=text("NOW()"))
 
 class Invoice(Base):
@@ -50,3 +51,20 @@ class Invoice(Base):
     due_date = Column(Date, nullable=True)
     public_url = Column(String(500), nullable=True) # Link to Square hosted invoice
     created_at = Column(TIMESTAMP, server_default=text("NOW()"))
+
+    customer = relationship("Customer")
+
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String(255), unique=True, nullable=False) # Square event_id, retries reuse it
+    event_type = Column(String(100))
+    payload = Column(Text) # Raw request body as received
+    created_at = Column(TIMESTAMP, server_default=text("NOW()"))
+
+# Daily paid revenue in admin analytics scans only PAID invoices by date
+Index("ix_invoice_paid_created", Invoice.created_at, postgresql_where=Invoice.status == "PAID")
+# Latest payment per customer in the admin customer list
+Index("ix_payment_customer_created", Payment.customer_id, Payment.created_at.desc())
+# At most one default card per customer
+Index("ux_pm_default", PaymentMethod.customer_id, unique=True, postgresql_where=PaymentMethod.is_default)
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, text
+from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, text, ForeignKey, Index, func
+from sqlalchemy.orm import relationship
 from db.init import Base
 
 class Customer(Base):
@@ -17,15 +18,20 @@ class Customer(Base):
     failed_payment_attempts = Column(Integer, default=0)
     
     # Square Integration Fields
-    square_customer_id = Column(String(255), nullable=True)
+    square_customer_id = Column(String(255), nullable=True, index=True) # Webhook lookups
     square_subscription_id = Column(String(255), nullable=True)
     subscription_active = Column(Boolean, default=False)
     subscription_status = Column(String(50), nullable=True) # ACTIVE, PAUSED, CANCELED, etc.
-    plan_id = Column(String(50), nullable=True) # basic, standard, premium
+    plan_id = Column(Integer, ForeignKey("subscription_plans.id"), nullable=True)
     plan_variation_id = Column(String(255), nullable=True) # Square Variation ID
     
     created_at = Column(TIMESTAMP, server_default=text("NOW()"))
 
+    plan = relationship("SubscriptionPlan", lazy="joined")
+
+# Serves the daily signup group-by in admin analytics
+Index("ix_customer_created_date", func.date(Customer.created_at))
+
 class Admin(Base):
     __tablename__ = "admins"
     id = Column(Integer, primary_key=True, index=True)
@@ -1,23 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, status
+from fastapi.responses import FileResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import joinedload, lazyload
 from typing import List, Optional
+import asyncio
+import logging
+from collections import Counter, defaultdict
 import os
 import tempfile
 from fpdf import FPDF
-from datetime import datetime, date, timedelta
-from pydantic import BaseModel
+from datetime import datetime, timedelta
+from pydantic import BaseModel, TypeAdapter
 
-from db.init import get_db
+from db.init import get_db, AsyncSessionLocal
 from models.user import Customer, Admin
 from models.subscription import SubscriptionPlan, SubscriptionLog, Invoice, Payment, PaymentMethod
-from utils.deps import get_current_user
-
-# Simple in-memory cache for stats
-_stats_cache = {"count": 0, "expires": datetime.min}
+from utils.deps import get_current_user, invalidate_cached_user
+from utils.invoices import square_invoice_row, invoice_upsert
 
 router = APIRouter(prefix="", tags=["admin"])
+logger = logging.getLogger(__name__)
+
+# One row per day of the analytics window with the running customer total
+# and paid revenue, gaps filled in by generate_series, plus the all-time
+# customer count on every row.
+ANALYTICS_TIMELINE_SQL = text("""
+    WITH days AS (
+        SELECT generate_series(CAST(:start_day AS date), CAST(:start_day AS date) + 30, interval '1 day')::date AS d
+    ), daily_new AS (
+        SELECT date(created_at) AS d, count(*) AS c
+        FROM customers
+        WHERE created_at >= :cutoff
+        GROUP BY 1
+    ), daily_rev AS (
+        SELECT date(created_at) AS d, sum(amount) AS total
+        FROM invoices
+        WHERE status = 'PAID' AND created_at >= :cutoff
+        GROUP BY 1
+    ), totals AS (
+        SELECT count(*) FILTER (WHERE created_at < :cutoff) AS pre, count(*) AS total
+        FROM customers
+    )
+    SELECT days.d,
+           totals.pre + sum(coalesce(daily_new.c, 0)) OVER (ORDER BY days.d) AS customers,
+           coalesce(daily_rev.total, 0) AS revenue,
+           totals.total
+    FROM days
+    CROSS JOIN totals
+    LEFT JOIN daily_new USING (d)
+    LEFT JOIN daily_rev USING (d)
+    ORDER BY days.d
+""")
 
 class CustomerListItem(BaseModel):
     id: int
@@ -33,6 +68,7 @@ class CustomerListItem(BaseModel):
     zip: str
     referralNumber: Optional[str] = None
 
+customer_list_adapter = TypeAdapter(List[CustomerListItem])
 
 class PlanDistributionItem(BaseModel):
     name: str
@@ -53,15 +89,15 @@ class AnalyticsResponse(BaseModel):
     growth_history: List[GrowthItem]
 
 @router.get("/stats")
-def get_admin_stats(
-    db: Session = Depends(get_db),
+async def get_admin_stats(
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    from utils.square_client import get_subscriptions
-    subs_res = get_subscriptions(status="ACTIVE")
+    from utils.square_client import cached_subscriptions
+    subs_res = await run_in_threadpool(cached_subscriptions, "ACTIVE")
     active_subs = subs_res.get("subscriptions", [])
     
     return {
@@ -69,91 +105,81 @@ def get_admin_stats(
     }
 
 @router.get("/recent-invoices")
-def get_recent_invoices(
-    db: Session = Depends(get_db),
+async def get_recent_invoices(
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
     from utils.square_client import list_recent_invoices
-    res = list_recent_invoices(limit=5)
+    res = await run_in_threadpool(list_recent_invoices, limit=5)
     if not res.get("success"):
         raise HTTPException(status_code=500, detail=res.get("error"))
     
     sq_invoices = res.get("invoices", [])
-    enriched = []
     
-    # Pre-fetch customers to avoid N+1
-    customer_ids = list(set([inv.get("customer_id") for inv in sq_invoices if inv.get("customer_id")]))
-    customers_map = {c.square_customer_id: f"{c.first_name} {c.last_name}" for c in db.query(Customer).filter(Customer.square_customer_id.in_(customer_ids)).all()}
-
+    # Pre-fetch customer names in one projected query to avoid N+1
+    customer_ids = list({inv["customer_id"] for inv in sq_invoices if inv.get("customer_id")})
+    customers_map = {}
+    if customer_ids:
+        cust_rows = (await db.execute(
+            select(Customer.square_customer_id, Customer.first_name, Customer.last_name)
+            .where(Customer.square_customer_id.in_(customer_ids))
+        )).all()
+        customers_map = {sid: f"{fn} {ln}" for sid, fn, ln in cust_rows}
+
+    # The Square payload is parsed fresh for this request, so enrich it in place
     for inv in sq_invoices:
-        i = inv.copy()
-        sq_cid = i.get("customer_id")
-        i["customer_name"] = customers_map.get(sq_cid, "Unknown Customer")
-        
-        # Calculate amount
-        amount = 0
-        if i.get("payment_requests"):
-            amount = int(i["payment_requests"][0].get("computed_amount_money", {}).get("amount", 0)) / 100.0
-        elif i.get("next_payment_amount_money"):
-             amount = int(i["next_payment_amount_money"].get("amount", 0)) / 100.0
+        inv["customer_name"] = customers_map.get(inv.get("customer_id"), "Unknown Customer")
+        inv["amount"] = recent_invoice_amount(inv)
+        inv["description"] = inv.get("title") or inv.get("description") or "Subscription Payment"
         
-        i["amount"] = amount
-        i["description"] = i.get("title") or i.get("description") or "Subscription Payment"
-        enriched.append(i)
-        
-    return {"success": True, "invoices": enriched}
+    return {"success": True, "invoices": sq_invoices}
+
+def recent_invoice_amount(inv: dict) -> float:
+    if inv.get("payment_requests"):
+        return int(inv["payment_requests"][0].get("computed_amount_money", {}).get("amount", 0)) / 100.0
+    if inv.get("next_payment_amount_money"):
+        return int(inv["next_payment_amount_money"].get("amount", 0)) / 100.0
+    return 0
 
 @router.get("/analytics", response_model=AnalyticsResponse)
-def get_admin_analytics(
-    db: Session = Depends(get_db),
+async def get_admin_analytics(
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    from utils.square_client import get_subscriptions, get_subscription_plans
+    from utils.square_client import get_variation_map
     
-    subs_res = get_subscriptions(status="ACTIVE")
-    active_subs = subs_res.get("subscriptions", [])
-    active_sub_count = len(active_subs)
-    
-    plans_res = get_subscription_plans()
-    plans = plans_res.get("plans", [])
-    
-    variation_map = {}
-    for p in plans:
-        p_name = p.get("name", "Unknown Plan")
-        for v in p.get("variations", []):
-            var_id = v.get("id")
-            phases = v.get("phases", [])
-            price = 0.0
-            if phases:
-                amount_money = phases[0].get("recurring_price_money", {})
-                price = float(amount_money.get("amount", 0)) / 100.0
-            
-            variation_map[var_id] = {"name": p_name, "price": price}
+    # Active subscribers per plan come from our own customers table; Square is
+    # only consulted (through the cache) for plan names and prices.
+    variation_map, plan_rows = await asyncio.gather(
+        run_in_threadpool(get_variation_map),
+        db.execute(
+            select(Customer.plan_variation_id, func.count())
+            .where(Customer.subscription_active == True)
+            .group_by(Customer.plan_variation_id)
+        )
+    )
 
     mrr = 0.0
-    plan_counts = {}
-    plan_revenue = {}
-    
-    for sub in active_subs:
-        var_id = sub.get("plan_variation_id")
-        if var_id and var_id in variation_map:
-            details = variation_map[var_id]
-            price = details["price"]
-            p_name = details["name"]
-            
-            mrr += price
-            plan_counts[p_name] = plan_counts.get(p_name, 0) + 1
-            plan_revenue[p_name] = plan_revenue.get(p_name, 0) + price
+    plan_counts = Counter()
+    plan_revenue = defaultdict(float)
+    
+    for var_id, count in plan_rows.all():
+        details = variation_map.get(var_id)
+        if details:
+            revenue = details["price"] * count
+            mrr += revenue
+            plan_counts[details["name"]] += count
+            plan_revenue[details["name"]] += revenue
         else:
-            p_name = "Unknown Plan"
-            plan_counts[p_name] = plan_counts.get(p_name, 0) + 1
-            plan_revenue[p_name] = plan_revenue.get(p_name, 0) + 0.0
+            plan_counts["Unknown Plan"] += count
+            plan_revenue["Unknown Plan"] += 0.0
+    active_sub_count = sum(plan_counts.values())
 
     colors = ["#21568F", "#2D6A4F", "#f59e0b", "#ef4444", "#8b5cf6"]
     plan_dist = []
@@ -174,41 +200,18 @@ def get_admin_analytics(
             color=color
         ))
         
-    total_customers = db.query(Customer).count()
-    
     thirty_days_ago = datetime.now() - timedelta(days=30)
     
-    daily_growth = db.query(
-        func.date(Customer.created_at).label('date'),
-        func.count(Customer.id)
-    ).filter(Customer.created_at >= thirty_days_ago)\
-     .group_by(func.date(Customer.created_at))\
-     .order_by(func.date(Customer.created_at))\
-     .all()
-     
-    growth_map = {str(d): c for d, c in daily_growth}
-
-    # Fetch daily revenue from Invoices table
-    daily_revenue = db.query(
-        func.date(Invoice.created_at).label('date'),
-        func.sum(Invoice.amount).label('total')
-    ).filter(Invoice.created_at >= thirty_days_ago, Invoice.status == 'PAID')\
-     .group_by(func.date(Invoice.created_at))\
-     .all()
-    
-    revenue_map = {str(d): float(t) for d, t in daily_revenue}
-    
-    growth_history = []
-    count_before = db.query(Customer).filter(Customer.created_at < thirty_days_ago).count()
-    current_total = count_before
-    
-    for i in range(31):
-        d = thirty_days_ago + timedelta(days=i)
-        d_str = d.strftime("%Y-%m-%d")
-        daily_new = growth_map.get(d_str, 0)
-        daily_rev = revenue_map.get(d_str, 0.0)
-        current_total += daily_new
-        growth_history.append(GrowthItem(date=d_str, customers=current_total, revenue=daily_rev))
+    rows = (await db.execute(
+        ANALYTICS_TIMELINE_SQL,
+        {"cutoff": thirty_days_ago, "start_day": thirty_days_ago.date()}
+    )).all()
+    
+    growth_history = [
+        GrowthItem(date=d.strftime("%Y-%m-%d"), customers=int(customers), revenue=float(revenue))
+        for d, customers, revenue, _ in rows
+    ]
+    total_customers = rows[0].total if rows else 0
 
     return AnalyticsResponse(
         mrr=mrr,
@@ -220,8 +223,8 @@ def get_admin_analytics(
     )
 
 @router.get("/customers", response_model=List[CustomerListItem])
-def list_customers(
-    db: Session = Depends(get_db),
+async def list_customers(
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
@@ -230,39 +233,30 @@ def list_customers(
             detail="Only admins can access this resource"
         )
     
-    customers = db.query(Customer).all()
-    all_plans = {p.id: p for p in db.query(SubscriptionPlan).all()}
-    
-    last_payments = db.query(
-        Payment.customer_id,
-        func.max(Payment.created_at)
-    ).group_by(Payment.customer_id).all()
-    last_payment_map = {cid: dt for cid, dt in last_payments}
+    rows = (await db.execute(
+        select(
+            Customer,
+            SubscriptionPlan.plan_name,
+            SubscriptionPlan.plan_cost,
+            func.max(Payment.created_at)
+        ).outerjoin(SubscriptionPlan, SubscriptionPlan.id == Customer.plan_id)
+         .outerjoin(Payment, Payment.customer_id == Customer.id)
+         .group_by(Customer.id, SubscriptionPlan.id)
+         .options(lazyload(Customer.plan))
+    )).all()
 
     result = []
-    for c in customers:
-        plan_name = "No Plan"
-        plan_cost = 0.0
-        
-        try:
-            pid = int(c.plan_id) if c.plan_id else None
-            if pid and pid in all_plans:
-                plan_name = all_plans[pid].plan_name
-                plan_cost = all_plans[pid].plan_cost
-        except (ValueError, TypeError):
-            pass
-
-        last_payment_date = last_payment_map.get(c.id)
+    for c, plan_name, plan_cost, last_payment_date in rows:
         last_payment_str = last_payment_date.strftime("%Y-%m-%d") if last_payment_date else "N/A"
 
-        result.append(CustomerListItem(
+        result.append(CustomerListItem.model_construct(
             id=c.id,
-            name=f"{c.first_name} {c.last_name}",
-            email=c.email,
+            name=f"{c.first_name or ''} {c.last_name or ''}".strip(),
+            email=c.email or "",
             phone=c.phone_number or "",
-            plan=plan_name,
+            plan=plan_name or "No Plan",
             status="Active" if c.subscription_active else "Inactive",
-            amount=plan_cost,
+            amount=plan_cost or 0.0,
             lastPayment=last_payment_str,
             address=c.address or "",
             city=c.city or "",
@@ -270,26 +264,30 @@ def list_customers(
             referralNumber=c.referral_number or ""
         ))
     
-    return result
+    # Rows come straight from the DB; serialize them once without re-validating.
+    # model_construct skips validation, so every nullable column is coalesced
+    # above to keep the str fields valid.
+    return Response(content=customer_list_adapter.dump_json(result), media_type="application/json")
 
 @router.post("/cancel-subscription/{customer_id}")
-def cancel_customer_subscription(
+async def cancel_customer_subscription(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer or not customer.square_subscription_id:
         raise HTTPException(status_code=404, detail="Active subscription not found")
     
-    from utils.square_client import cancel_subscription
-    res = cancel_subscription(customer.square_subscription_id)
+    from utils.square_client import cancel_subscription, invalidate_subscription_cache
+    res = await run_in_threadpool(cancel_subscription, customer.square_subscription_id)
     
     if not res.get("subscription"):
         raise HTTPException(status_code=400, detail="Square error or failed to cancel")
+    invalidate_subscription_cache()
     
     customer.subscription_active = False
     customer.subscription_status = "CANCELED"
@@ -298,29 +296,29 @@ def cancel_customer_subscription(
     log = SubscriptionLog(
         customer_id=customer.id,
         subscription_id=customer.square_subscription_id,
-        action="CANCEL",
-        effective_date=date.today()
+        action="CANCEL"
     )
     db.add(log)
-    db.commit()
+    await db.commit()
+    await invalidate_cached_user(customer.id)
     
     return {"success": True, "message": "Subscription canceled"}
 
 @router.get("/customer-cards/{customer_id}")
-def get_customer_cards(
+async def get_customer_cards(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer or not customer.square_customer_id:
         raise HTTPException(status_code=404, detail="Square customer not found")
     
     from utils.square_client import get_customer_cards
-    res = get_customer_cards(customer.square_customer_id)
+    res = await run_in_threadpool(get_customer_cards, customer.square_customer_id)
     
     if not res.get("success"):
         raise HTTPException(status_code=400, detail=f"Square error: {res.get('error')}")
@@ -328,17 +326,17 @@ def get_customer_cards(
     return res
 
 @router.post("/remove-card/{customer_id}/{card_id}")
-def remove_customer_card(
+async def remove_customer_card(
     customer_id: int,
     card_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
     from utils.square_client import disable_card
-    res = disable_card(card_id)
+    res = await run_in_threadpool(disable_card, card_id)
     
     if "errors" in res:
         raise HTTPException(status_code=400, detail="Square error")
@@ -349,21 +347,21 @@ class SaveCardRequest(BaseModel):
     source_id: str
 
 @router.post("/save-card/{customer_id}")
-def admin_save_customer_card(
+async def admin_save_customer_card(
     customer_id: int,
     request: SaveCardRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer or not customer.square_customer_id:
         raise HTTPException(status_code=404, detail="Square customer not found")
     
     from utils.square_client import create_card_on_file
-    res = create_card_on_file(request.source_id, customer.square_customer_id)
+    res = await run_in_threadpool(create_card_on_file, request.source_id, customer.square_customer_id)
     
     if not res.get("success"):
         raise HTTPException(status_code=400, detail=f"Square error: {res.get('error')}")
@@ -380,36 +378,19 @@ class UpdateCustomerRequest(BaseModel):
     zip_code: str
 
 @router.put("/customer-details/{customer_id}")
-def update_customer_details(
+async def update_customer_details(
     customer_id: int,
     request: UpdateCustomerRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    if customer.square_customer_id:
-        from utils.square_client import update_square_customer
-        sq_res = update_square_customer(
-            customer.square_customer_id,
-            given_name=request.first_name,
-            family_name=request.last_name,
-            email_address=request.email,
-            phone_number=request.phone_number,
-            address={
-                "address_line_1": request.address,
-                "locality": request.city,
-                "postal_code": request.zip_code
-            }
-        )
-        if not sq_res.get("success"):
-            raise HTTPException(status_code=400, detail=f"Square sync error: {sq_res.get('error')}")
-
     customer.first_name = request.first_name
     customer.last_name = request.last_name
     customer.email = request.email
@@ -418,24 +399,48 @@ def update_customer_details(
     customer.city = request.city
     customer.zip_code = request.zip_code
     
-    db.commit()
+    if customer.square_customer_id:
+        from utils.square_client import update_square_customer
+        # Flush the local UPDATE while Square processes its copy; only commit if Square accepted it
+        sq_res, _ = await asyncio.gather(
+            run_in_threadpool(
+                update_square_customer,
+                customer.square_customer_id,
+                given_name=request.first_name,
+                family_name=request.last_name,
+                email_address=request.email,
+                phone_number=request.phone_number,
+                address={
+                    "address_line_1": request.address,
+                    "locality": request.city,
+                    "postal_code": request.zip_code
+                }
+            ),
+            db.flush()
+        )
+        if not sq_res.get("success"):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=f"Square sync error: {sq_res.get('error')}")
+
+    await db.commit()
+    await invalidate_cached_user(customer.id)
     return {"success": True, "message": "Customer details updated"}
 
 @router.get("/customer-payments/{customer_id}")
-def get_customer_payments(
+async def get_customer_payments(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer or not customer.square_customer_id:
         raise HTTPException(status_code=404, detail="Square customer not found")
     
     from utils.square_client import get_customer_invoices
-    res = get_customer_invoices(customer.square_customer_id)
+    res = await run_in_threadpool(get_customer_invoices, customer.square_customer_id)
     
     if not res.get("success"):
         raise HTTPException(status_code=400, detail=f"Square error: {res.get('error')}")
@@ -445,133 +450,168 @@ def get_customer_payments(
 class ChangeSubscriptionRequest(BaseModel):
     new_plan_variation_id: str
 
-@router.post("/change-subscription/{customer_id}")
-def admin_change_subscription(
+# SubscriptionLog actions that track an admin plan change; the latest one is
+# the change's current state
+CHANGE_ACTIONS = ("CHANGE_PENDING", "CHANGE_FAILED", "CHANGE_APPLIED")
+
+@router.post("/change-subscription/{customer_id}", status_code=status.HTTP_202_ACCEPTED)
+async def admin_change_subscription(
     customer_id: int,
     request: ChangeSubscriptionRequest,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
         
     if not customer.square_subscription_id:
         raise HTTPException(status_code=400, detail="Customer has no active subscription")
+
+    from utils.square_client import get_variation_map
+    variation_map = await run_in_threadpool(get_variation_map)
+    # An empty map means the catalog couldn't be fetched; Square will reject
+    # a bad id then, and the failure is recorded for polling
+    if variation_map and request.new_plan_variation_id not in variation_map:
+        raise HTTPException(status_code=400, detail="Unknown plan variation")
+
+    db.add(SubscriptionLog(
+        customer_id=customer.id,
+        subscription_id=customer.square_subscription_id,
+        action="CHANGE_PENDING"
+    ))
+    await db.commit()
+    
+    # The Square swap is slow; apply it and the local plan change after
+    # responding. Poll GET /change-subscription/{customer_id} for the outcome.
+    background_tasks.add_task(
+        apply_subscription_change,
+        customer.id,
+        customer.square_subscription_id,
+        request.new_plan_variation_id
+    )
     
-    from utils.square_client import update_subscription
-    res = update_subscription(customer.square_subscription_id, request.new_plan_variation_id)
-    
+    return {"success": True, "status": "PENDING", "message": "Subscription update accepted"}
+
+@router.get("/change-subscription/{customer_id}")
+async def admin_change_subscription_status(
+    customer_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Admin = Depends(get_current_user)
+):
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    last = (await db.execute(
+        select(SubscriptionLog.action, SubscriptionLog.created_at)
+        .where(SubscriptionLog.customer_id == customer_id, SubscriptionLog.action.in_(CHANGE_ACTIONS))
+        .order_by(SubscriptionLog.id.desc())
+        .limit(1)
+    )).first()
+    if not last:
+        raise HTTPException(status_code=404, detail="No plan change found")
+
+    change_status = {"CHANGE_PENDING": "PENDING", "CHANGE_FAILED": "FAILED", "CHANGE_APPLIED": "APPLIED"}[last.action]
+    return {"status": change_status, "updated_at": last.created_at}
+
+async def apply_subscription_change(customer_id: int, subscription_id: str, new_plan_variation_id: str):
+    try:
+        await swap_subscription_plan(customer_id, subscription_id, new_plan_variation_id)
+    except Exception:
+        # Whatever went wrong, don't leave the change reported as pending
+        logger.exception("Plan change to %s failed for customer %s", new_plan_variation_id, customer_id)
+        async with AsyncSessionLocal() as db:
+            db.add(SubscriptionLog(customer_id=customer_id, subscription_id=subscription_id, action="CHANGE_FAILED"))
+            await db.commit()
+
+async def swap_subscription_plan(customer_id: int, subscription_id: str, new_plan_variation_id: str):
+    from utils.square_client import update_subscription, invalidate_subscription_cache, invalidate_plan_cache
+    res = await run_in_threadpool(update_subscription, subscription_id, new_plan_variation_id)
     if not res.get("success"):
-        raise HTTPException(status_code=400, detail=f"Square error: {res.get('error')}")
-        
-    plan = db.query(SubscriptionPlan).filter(SubscriptionPlan.plan_variation_id == request.new_plan_variation_id).first()
-    if plan:
-        customer.plan_id = str(plan.id)
-        customer.plan_variation_id = request.new_plan_variation_id
+        raise RuntimeError(f"Square plan swap failed for subscription {subscription_id}: {res.get('error')}")
+    invalidate_subscription_cache()
+    # The target variation may be new to the catalog snapshot we hold
+    invalidate_plan_cache()
+
+    async with AsyncSessionLocal() as db:
+        customer = await db.get(Customer, customer_id)
+        if not customer:
+            # Square already moved the plan, so this needs manual attention
+            raise RuntimeError(f"Customer {customer_id} vanished after Square swapped subscription {subscription_id}")
+
+        # Seeded plans may carry placeholder variation ids; a Square variation
+        # with no local plan still moves the customer, just without a plan_id
+        plan_id = await db.scalar(select(SubscriptionPlan.id).where(SubscriptionPlan.plan_variation_id == new_plan_variation_id))
+        customer.plan_id = plan_id
+        customer.plan_variation_id = new_plan_variation_id
         
         # Log action
         log = SubscriptionLog(
-            customer_id=customer.id,
-            subscription_id=customer.square_subscription_id,
-            action="ACTIVATE", # Or "CHANGE" if we had that, but "ACTIVATE" implies new plan session
-            effective_date=date.today()
+            customer_id=customer_id,
+            subscription_id=subscription_id,
+            action="CHANGE_APPLIED"
         )
         db.add(log)
-        db.commit()
-    
-    return {"success": True, "message": "Subscription updated successfully"}
+        await db.commit()
+        await invalidate_cached_user(customer_id)
 
 @router.post("/sync-invoices/{customer_id}")
-def sync_customer_invoices(
+async def sync_customer_invoices(
     customer_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    customer = db.query(Customer).get(customer_id)
+    customer = await db.get(Customer, customer_id)
     if not customer or not customer.square_customer_id:
         raise HTTPException(status_code=404, detail="Customer not found or no Square ID")
     
     from utils.square_client import get_customer_invoices
-    res = get_customer_invoices(customer.square_customer_id)
+    res = await run_in_threadpool(get_customer_invoices, customer.square_customer_id)
     
     if not res.get("success"):
         raise HTTPException(status_code=400, detail=f"Square error: {res.get('error')}")
     
-    sq_invoices = res.get("invoices", [])
-    synced_count = 0
+    rows = [square_invoice_row(sq_inv, customer.id) for sq_inv in res.get("invoices", [])]
     
-    for sq_inv in sq_invoices:
-        inv_id = sq_inv.get("id")
-        
-        amount_data = {}
-        if sq_inv.get("payment_requests"):
-            amount_data = sq_inv.get("payment_requests")[0].get("computed_amount_money", {})
-        if not amount_data.get("amount") and sq_inv.get("next_payment_amount_money"):
-             amount_data = sq_inv.get("next_payment_amount_money")
-             
-        amount = float(amount_data.get("amount", 0)) / 100.0
-        
-        existing = db.query(Invoice).filter(Invoice.square_invoice_id == inv_id).first()
-        
-        due_date_str = sq_inv.get("scheduled_at") or sq_inv.get("created_at", datetime.now().isoformat())
-        try:
-            if "T" in due_date_str:
-                due_date = datetime.fromisoformat(due_date_str.replace("Z", "+00:00")).date()
-            else:
-                due_date = datetime.strptime(due_date_str, "%Y-%m-%d").date()
-        except:
-            due_date = datetime.now().date()
-
-        if not existing:
-            new_inv = Invoice(
-                square_invoice_id=inv_id,
-                customer_id=customer.id,
-                subscription_id=sq_inv.get("subscription_id"),
-                amount=amount,
-                status=sq_inv.get("status"),
-                due_date=due_date,
-                public_url=sq_inv.get("public_url")
-            )
-            db.add(new_inv)
-            synced_count += 1
-        else:
-            existing.status = sq_inv.get("status")
-            existing.public_url = sq_inv.get("public_url")
-            existing.amount = amount
-    
-    db.commit()
+    synced_count = 0
+    if rows:
+        # Executemany-style upsert: SQLAlchemy's insertmanyvalues packs the
+        # parameter list into batched multi-row VALUES, and asyncpg keeps a
+        # single prepared statement.
+        inserted = (await db.execute(invoice_upsert(), rows)).scalars().all()
+        synced_count = sum(1 for was_inserted in inserted if was_inserted)
+    
+    await db.commit()
     return {"success": True, "synced": synced_count}
 
 @router.get("/invoice-pdf/{square_invoice_id}")
-def download_invoice_pdf(
+async def download_invoice_pdf(
     square_invoice_id: str,
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
     current_user: Admin = Depends(get_current_user)
 ):
     if current_user.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
         
-    invoice = db.query(Invoice).filter(Invoice.square_invoice_id == square_invoice_id).first()
+    # Invoice, its customer and the customer's plan in one joined query
+    invoice = (await db.execute(
+        select(Invoice)
+        .options(joinedload(Invoice.customer))
+        .where(Invoice.square_invoice_id == square_invoice_id)
+    )).scalars().first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found. Please sync first.")
         
-    customer = db.query(Customer).get(invoice.customer_id)
-    
-    plan_name = "Subscription Service"
-    if customer.plan_id:
-        try:
-            plan = db.query(SubscriptionPlan).get(int(customer.plan_id))
-            if plan:
-                plan_name = plan.plan_name
-        except:
-            pass
+    customer = invoice.customer
+    plan_name = customer.plan.plan_name if customer.plan else "Subscription Service"
             
     from utils.pdf_generator import generate_invoice_pdf
-    return generate_invoice_pdf(invoice, customer, plan_name)
+    return await run_in_threadpool(generate_invoice_pdf, invoice, customer, plan_name, if_none_match)
@@ -1,13 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 from db.init import get_db
 from models.user import Customer, Admin
 from models.subscription import SubscriptionPlan
 from utils.security import hash_password, verify_password, create_access_token
 from typing import Optional
 from pydantic import BaseModel, EmailStr
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class SignupRequest(BaseModel):
     firstName: str
@@ -26,15 +30,50 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+async def resolve_signup_plan(db: AsyncSession, plan: Optional[str], plan_variation_id: Optional[str]) -> Optional[int]:
+    """
+    SubscriptionPlan id for the signup form. plan may be a plan id, a plan
+    name, or a slug such as "basic" (the first word of the plan name); when it
+    matches nothing, the Square variation id is tried. None if neither matches.
+    """
+    if plan and plan.isdigit():
+        plan_id = await db.scalar(select(SubscriptionPlan.id).where(SubscriptionPlan.id == int(plan)))
+        if plan_id is not None:
+            return plan_id
+    elif plan:
+        name = func.lower(SubscriptionPlan.plan_name)
+        plan_id = await db.scalar(
+            select(SubscriptionPlan.id)
+            .where((name == plan.lower()) | (func.split_part(name, " ", 1) == plan.lower()))
+            .order_by(SubscriptionPlan.id)
+            .limit(1)
+        )
+        if plan_id is not None:
+            return plan_id
+    if plan_variation_id:
+        return await db.scalar(
+            select(SubscriptionPlan.id)
+            .where(SubscriptionPlan.plan_variation_id == plan_variation_id)
+            .order_by(SubscriptionPlan.id)
+            .limit(1)
+        )
+    return None
+
 @router.post("/signup")
-def signup(request: SignupRequest, db: Session = Depends(get_db)):
+async def signup(request: SignupRequest, db: AsyncSession = Depends(get_db)):
     # Check if user exists
-    existing_user = db.query(Customer).filter(Customer.email == request.email).first()
+    existing_user = await db.scalar(select(Customer.id).where(Customer.email == request.email))
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
+
+    plan_id = await resolve_signup_plan(db, request.plan, request.planVariationId)
+    if plan_id is None and (request.plan or request.planVariationId):
+        # Don't lose the registration over a plan we can't map; the variation
+        # id is still stored and the plan can be fixed up later
+        logger.warning("Signup for %s with unknown plan %r / variation %r", request.email, request.plan, request.planVariationId)
     
-    # Use the hash_password utility from security.py
-    hashed_password = hash_password(request.password) 
+    # Key derivation is CPU-bound; keep it off the event loop
+    hashed_password = await run_in_threadpool(hash_password, request.password)
     
     new_user = Customer(
         first_name=request.firstName,
@@ -45,7 +84,7 @@ def signup(request: SignupRequest, db: Session = Depends(get_db)):
         address=request.address,
         city=request.city,
         zip_code=request.zip,
-        plan_id=request.plan,
+        plan_id=plan_id,
         plan_variation_id=request.planVariationId,
         referral_number=request.referralNumber,
         subscription_active=False,
@@ -53,16 +92,10 @@ def signup(request: SignupRequest, db: Session = Depends(get_db)):
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # The INSERT returns the new id; every other field below was set here
+    await db.commit()
     
-    # Create simple access token
-    access_token = f"token_{new_user.id}"
-    
-    # Get plan details safely
-    plan_obj = None
-    if new_user.plan_id and str(new_user.plan_id).isdigit():
-        plan_obj = db.query(SubscriptionPlan).filter(SubscriptionPlan.id == int(new_user.plan_id)).first()
+    access_token = create_access_token(data={"sub": new_user.email, "id": new_user.id})
 
     return {
         "access_token": access_token,
@@ -75,23 +108,20 @@ def signup(request: SignupRequest, db: Session = Depends(get_db)):
             "lastName": new_user.last_name,
             "role": "customer",
             "plan_id": new_user.plan_id,
-            "plan_name": plan_obj.plan_name if plan_obj else "Active Plan",
-            "plan_cost": plan_obj.plan_cost if plan_obj else 0,
             "subscription_status": new_user.subscription_status
         }
     }
 
 @router.post("/login")
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(Customer).filter(Customer.email == request.email).first()
-    if not user or not verify_password(request.password, user.password_hash):
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(Customer).where(Customer.email == request.email))
+    if not user or not await run_in_threadpool(verify_password, request.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     access_token = create_access_token(data={"sub": user.email, "id": user.id})
     
-    plan_obj = None
-    if user.plan_id and str(user.plan_id).isdigit():
-        plan_obj = db.query(SubscriptionPlan).filter(SubscriptionPlan.id == int(user.plan_id)).first()
+    # Loaded in the same SELECT through the joined Customer.plan relationship
+    plan_obj = user.plan
 
     return {"access_token": access_token, "token_type": "bearer", "user": {
         "id": user.id,
@@ -106,26 +136,21 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
     }}
 
 @router.post("/admin/login")
-def admin_login(request: LoginRequest, db: Session = Depends(get_db)):
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    logger.info(f"Admin login attempt for email: {request.email}")
+async def admin_login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
+    logger.debug("Admin login attempt for email: %s", request.email)
     
-    admin = db.query(Admin).filter(Admin.email == request.email).first()
+    admin = await db.scalar(select(Admin).where(Admin.email == request.email))
     
     if not admin:
-        logger.warning(f"Admin not found for email: {request.email}")
+        logger.warning("Admin not found for email: %s", request.email)
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    logger.info(f"Admin found: {admin.email}, verifying password...")
-    password_valid = verify_password(request.password, admin.password_hash)
+    password_valid = await run_in_threadpool(verify_password, request.password, admin.password_hash)
     
     if not password_valid:
-        logger.warning(f"Password verification failed for email: {request.email}")
+        logger.warning("Password verification failed for email: %s", request.email)
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    logger.info(f"Login successful for admin: {admin.email}")
     access_token = create_access_token(data={"sub": admin.email, "id": admin.id, "role": "admin"})
     return {"access_token": access_token, "token_type": "bearer", "user": {
         "id": admin.id,
@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import lazyload
 from typing import Optional, List, Dict, Any
 from db.init import get_db
 from models.user import Customer
 from models.subscription import SubscriptionPlan, Payment, PaymentMethod, SubscriptionLog
-from utils.deps import get_current_user, get_db_user
+from utils.deps import get_current_user, get_db_user, invalidate_cached_user
+from utils.invoices import square_invoice_row, invoice_upsert
+from utils.redis_client import claim_once
 from utils.square_client import (
-    get_subscription_plans,
+    SQUARE_LOCATION_ID,
+    cached_subscription_plans,
+    get_plans_map,
     create_square_customer,
     create_card_on_file,
     get_customer_cards,
@@ -21,20 +28,42 @@ from utils.square_client import (
     get_customer_invoices
 )
 from pydantic import BaseModel
+import asyncio
 import os
 import uuid
-from datetime import date, datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
-class MockInvoice:
-    def __init__(self, **kwargs):
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+SQUARE_APPLICATION_ID = os.getenv("SQUARE_APPLICATION_ID", "")
 
 router = APIRouter()
 
+# Demote the customer's current default card and insert the new default in
+# one round trip. Counting the cleared rows makes the INSERT wait for the
+# UPDATE, so ux_pm_default never sees two defaults for one customer.
+SET_DEFAULT_CARD_SQL = text("""
+    WITH cleared AS (
+        UPDATE payment_methods SET is_default = false
+        WHERE customer_id = :customer_id AND is_default
+        RETURNING id
+    )
+    INSERT INTO payment_methods
+        (customer_id, square_card_id, last_4_digits, card_brand, exp_month, exp_year, is_default)
+    SELECT :customer_id, :square_card_id, :last_4_digits, :card_brand, :exp_month, :exp_year, true
+    FROM (SELECT count(*) FROM cleared) AS c
+""")
+
+def default_card_params(customer_id: int, card_res: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "customer_id": customer_id,
+        "square_card_id": card_res.get("card_id"),
+        "last_4_digits": card_res.get("last_4"),
+        "card_brand": card_res.get("brand"),
+        "exp_month": card_res.get("exp_month"),
+        "exp_year": card_res.get("exp_year"),
+    }
+
 # --- Pydantic Models ---
 
 class ValidateCardRequest(BaseModel):
@@ -63,28 +92,35 @@ class SaveCardRequest(BaseModel):
 # --- Endpoints ---
 
 @router.get("/square-config")
-def get_square_config():
+async def get_square_config():
     return {
-        "application_id": os.getenv("SQUARE_APPLICATION_ID", ""),
-        "location_id": os.getenv("SQUARE_LOCATION_ID", "")
+        "application_id": SQUARE_APPLICATION_ID,
+        "location_id": SQUARE_LOCATION_ID
     }
 
 @router.get("/subscription-plans")
-def get_square_plans():
+async def get_square_plans():
     """Fetch all subscription plans directly from Square Catalog."""
-    result = get_subscription_plans()
+    result = await run_in_threadpool(cached_subscription_plans)
     if not result.get("success"):
         raise HTTPException(status_code=500, detail=result.get("error"))
     return result
 
 @router.get("/subscription-plans/db")
-def get_db_plans(db: Session = Depends(get_db)):
+async def get_db_plans(db: AsyncSession = Depends(get_db)):
     """Fetch all subscription plans from local database."""
-    plans = db.query(SubscriptionPlan).all()
-    return {"success": True, "plans": plans}
+    # Plain column rows encode directly; ORM instances would be walked attribute by attribute
+    plans = (await db.execute(select(
+        SubscriptionPlan.id,
+        SubscriptionPlan.plan_name,
+        SubscriptionPlan.plan_cost,
+        SubscriptionPlan.plan_variation_id,
+        SubscriptionPlan.plan_description
+    ))).mappings().all()
+    return {"success": True, "plans": [dict(p) for p in plans]}
 
 @router.post("/validate-card")
-def validate_card(request: ValidateCardRequest, db: Session = Depends(get_db)):
+async def validate_card(request: ValidateCardRequest, db: AsyncSession = Depends(get_db)):
     """
     1. Create/Get Square Customer.
     2. Attach Card to Square Customer.
@@ -92,9 +128,15 @@ def validate_card(request: ValidateCardRequest, db: Session = Depends(get_db)):
     """
     customer = None
     if request.customer_id:
-        customer = db.query(Customer).get(request.customer_id)
+        customer = (await db.execute(
+            select(
+                Customer.id, Customer.square_customer_id, Customer.first_name,
+                Customer.last_name, Customer.email, Customer.phone_number
+            ).where(Customer.id == request.customer_id)
+        )).first()
     
     sq_customer_id = customer.square_customer_id if customer else None
+    new_sq_customer = False
     
     if not sq_customer_id:
         # Create Square Customer
@@ -102,7 +144,8 @@ def validate_card(request: ValidateCardRequest, db: Session = Depends(get_db)):
         family_name = request.family_name or (customer.last_name if customer else "User")
         email = request.email or (customer.email if customer else f"guest_{uuid.uuid4().hex[:8]}@example.com")
         
-        res = create_square_customer(
+        res = await run_in_threadpool(
+            create_square_customer,
             given_name=given_name,
             family_name=family_name,
             email=email,
@@ -112,35 +155,34 @@ def validate_card(request: ValidateCardRequest, db: Session = Depends(get_db)):
         if not res.get("success"):
             raise HTTPException(status_code=400, detail=f"Square customer creation failed: {res.get('error')}")
         sq_customer_id = res.get("customer_id")
-        
-        if customer:
-            customer.square_customer_id = sq_customer_id
-            db.commit()
+        new_sq_customer = customer is not None
 
     # Attach Card
-    card_res = create_card_on_file(
+    card_res = await run_in_threadpool(
+        create_card_on_file,
         source_id=request.source_id,
         customer_id=sq_customer_id
     )
     
+    # Link the new Square customer locally even if the card is declined,
+    # so a retry doesn't create another one. All writes share one commit.
+    if new_sq_customer:
+        await db.execute(
+            update(Customer).where(Customer.id == customer.id).values(square_customer_id=sq_customer_id)
+        )
+
     if not card_res.get("success"):
+        if new_sq_customer:
+            await db.commit()
+            await invalidate_cached_user(customer.id)
         raise HTTPException(status_code=400, detail=f"Card validation failed: {card_res.get('error')}")
 
     # Save Payment Method to DB if customer exists
     if customer:
-        new_method = PaymentMethod(
-            customer_id=customer.id,
-            square_card_id=card_res.get("card_id"),
-            last_4_digits=card_res.get("last_4"),
-            card_brand=card_res.get("brand"),
-            exp_month=card_res.get("exp_month"),
-            exp_year=card_res.get("exp_year"),
-            is_default=True
-        )
-        # Set others to not default
-        db.query(PaymentMethod).filter(PaymentMethod.customer_id == customer.id).update({"is_default": False})
-        db.add(new_method)
-        db.commit()
+        await db.execute(SET_DEFAULT_CARD_SQL, default_card_params(customer.id, card_res))
+        await db.commit()
+        if new_sq_customer:
+            await invalidate_cached_user(customer.id)
 
     return {
         "success": True,
@@ -150,17 +192,18 @@ def validate_card(request: ValidateCardRequest, db: Session = Depends(get_db)):
     }
 
 @router.get("/my-cards")
-def get_my_cards(user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def get_my_cards(user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     """Fetch saved payment methods for the authenticated customer."""
     if not user.square_customer_id:
         return {"success": True, "cards": []}
     
-    # 1. Fetch from local DB
-    db_methods = db.query(PaymentMethod).filter(PaymentMethod.customer_id == user.id).all()
+    # 1. Fetch from local DB while 2. Square is queried to ensure sync
+    db_methods, sq_res = await asyncio.gather(
+        db.scalars(select(PaymentMethod).where(PaymentMethod.customer_id == user.id)),
+        run_in_threadpool(get_customer_cards, user.square_customer_id)
+    )
     db_card_map = {pm.square_card_id: pm for pm in db_methods}
     
-    # 2. Fetch from Square to ensure sync
-    sq_res = get_customer_cards(user.square_customer_id)
     sq_cards = sq_res.get("cards", []) if sq_res.get("success") else []
     
     # 3. Merge: Start with Square cards and enrich with DB info if available
@@ -202,14 +245,15 @@ def get_my_cards(user: Customer = Depends(get_db_user), db: Session = Depends(ge
     }
 
 @router.post("/save-card")
-def save_card(request: SaveCardRequest, user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def save_card(request: SaveCardRequest, user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     """
     Save a new payment method for the logged-in customer.
     If they have an active subscription, update it to use this new card.
     """
     if not user.square_customer_id:
         # Should ideally have one by now if they reached dashboard, but let's be safe
-        res = create_square_customer(
+        res = await run_in_threadpool(
+            create_square_customer,
             given_name=user.first_name,
             family_name=user.last_name,
             email=user.email,
@@ -218,10 +262,12 @@ def save_card(request: SaveCardRequest, user: Customer = Depends(get_db_user), d
         if not res.get("success"):
             raise HTTPException(status_code=400, detail=f"Failed to create Square customer: {res.get('error')}")
         user.square_customer_id = res.get("customer_id")
-        db.commit()
+        await db.commit()
+        await invalidate_cached_user(user.id)
 
     # 1. Create Card in Square
-    card_res = create_card_on_file(
+    card_res = await run_in_threadpool(
+        create_card_on_file,
         source_id=request.source_id,
         customer_id=user.square_customer_id
     )
@@ -231,27 +277,18 @@ def save_card(request: SaveCardRequest, user: Customer = Depends(get_db_user), d
         
     card_id = card_res.get("card_id")
     
-    # 2. Save to Local DB
-    # Disable previous default
-    db.query(PaymentMethod).filter(PaymentMethod.customer_id == user.id).update({"is_default": False})
+    # 2. Save to Local DB as the new default
+    await db.execute(SET_DEFAULT_CARD_SQL, default_card_params(user.id, card_res))
     
-    new_method = PaymentMethod(
-        customer_id=user.id,
-        square_card_id=card_id,
-        last_4_digits=card_res.get("last_4"),
-        card_brand=card_res.get("brand"),
-        exp_month=card_res.get("exp_month"),
-        exp_year=card_res.get("exp_year"),
-        is_default=True
-    )
-    db.add(new_method)
-    
-    # 3. Update active subscription if exists
+    # 3. Update active subscription if exists, alongside the commit
     if user.square_subscription_id and user.subscription_active:
-        logger.info(f"Updating subscription {user.square_subscription_id} to use new card {card_id}")
-        update_subscription_card(user.square_subscription_id, card_id)
-    
-    db.commit()
+        logger.debug("Updating subscription %s to use new card %s", user.square_subscription_id, card_id)
+        await asyncio.gather(
+            run_in_threadpool(update_subscription_card, user.square_subscription_id, card_id),
+            db.commit()
+        )
+    else:
+        await db.commit()
     
     return {
         "success": True,
@@ -260,20 +297,20 @@ def save_card(request: SaveCardRequest, user: Customer = Depends(get_db_user), d
     }
 
 @router.delete("/remove-card/{card_id}")
-def remove_card(card_id: str, user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def remove_card(card_id: str, user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     """Disable a card in Square and remove from local DB."""
     # 1. Disable in Square
-    disable_card(card_id)
+    await run_in_threadpool(disable_card, card_id)
     
     # 2. Remove from Local DB (or mark as inactive)
-    method = db.query(PaymentMethod).filter(
+    method = await db.scalar(select(PaymentMethod).where(
         PaymentMethod.customer_id == user.id,
         PaymentMethod.square_card_id == card_id
-    ).first()
+    ))
     
     if method:
-        db.delete(method)
-        db.commit()
+        await db.delete(method)
+        await db.commit()
         
     return {"success": True, "message": "Card removed successfully"}
 
@@ -286,16 +323,26 @@ def dummy_create_subscription(customer_id: str, location_id: str, plan_variation
     }
 
 @router.post("/activate-subscription")
-def activate_sub(request: ActivateSubscriptionRequest, db: Session = Depends(get_db)):
+async def activate_sub(request: ActivateSubscriptionRequest, db: AsyncSession = Depends(get_db)):
     customer = None
+    plan_cost = None
     if request.customer_id:
-        customer = db.query(Customer).get(request.customer_id)
+        # Customer and the cost of the requested plan in one round trip
+        row = (await db.execute(
+            select(Customer, SubscriptionPlan.plan_cost)
+            .outerjoin(SubscriptionPlan, SubscriptionPlan.plan_variation_id == request.plan_variation_id)
+            .where(Customer.id == request.customer_id)
+            .options(lazyload(Customer.plan))
+            .limit(1)
+        )).first()
+        if row:
+            customer, plan_cost = row
     
     sq_customer_id = customer.square_customer_id if customer else None
     if not sq_customer_id:
         raise HTTPException(status_code=400, detail="Square customer ID missing")
 
-    location_id = request.location_id or os.getenv("SQUARE_LOCATION_ID")
+    location_id = request.location_id or SQUARE_LOCATION_ID
     
     # Create subscription using dummy function to match Skeeter logic
     res = dummy_create_subscription(
@@ -313,14 +360,12 @@ def activate_sub(request: ActivateSubscriptionRequest, db: Session = Depends(get
         customer.square_subscription_id = res.get("subscription_id")
         customer.subscription_active = True
         customer.subscription_status = "ACTIVE"
-        db.commit()
         
         # Log payment locally
-        plan = db.query(SubscriptionPlan).filter(SubscriptionPlan.plan_variation_id == request.plan_variation_id).first()
-        if plan:
+        if plan_cost is not None:
             new_payment = Payment(
                 customer_id=customer.id,
-                amount=plan.plan_cost,
+                amount=plan_cost,
                 status="PAID",
                 square_transaction_id=res.get("subscription_id")
             )
@@ -330,70 +375,50 @@ def activate_sub(request: ActivateSubscriptionRequest, db: Session = Depends(get
         log = SubscriptionLog(
             customer_id=customer.id,
             subscription_id=res.get("subscription_id"),
-            action="ACTIVATE",
-            effective_date=date.today()
+            action="ACTIVATE"
         )
         db.add(log)
-        db.commit()
+        await db.commit()
+        await invalidate_cached_user(customer.id)
 
     return res
 
 @router.get("/my-subscriptions")
-def get_my_subs(user: Customer = Depends(get_db_user)):
+async def get_my_subs(user: Customer = Depends(get_db_user)):
     if not user.square_customer_id:
         return {"success": True, "subscriptions": []}
     
     # Fetch user's subscriptions
-    subs_res = get_subscriptions(customer_id=user.square_customer_id)
+    subs_res = await run_in_threadpool(get_subscriptions, customer_id=user.square_customer_id)
     if not subs_res.get("success"):
         return subs_res
         
     subscriptions = subs_res.get("subscriptions", [])
     
-    # Fetch all plans to map names and amounts
-    plans_res = get_subscription_plans()
-    plans_map = {}
-    if plans_res.get("success"):
-        for p in plans_res.get("plans", []):
-            for v in p.get("variations", []):
-                # Try to get price from the first phase
-                price = 0
-                if v.get("phases") and len(v["phases"]) > 0:
-                    price = int(v["phases"][0].get("recurring_price_money", {}).get("amount", 0))
-                
-                plans_map[v["id"]] = {
-                    "name": f"{p['name']} - {v['name']}",
-                    "amount": price
-                }
+    # Plan names and amounts come from the cached catalog
+    plans_map = await run_in_threadpool(get_plans_map)
     
     # Enrich subscriptions
+    unknown_plan = {"name": "Unknown Plan", "amount": 0}
     enriched_subs = []
     for sub in subscriptions:
-        # Create a copy to modify
-        s = sub.copy()
-        var_id = s.get("plan_variation_id")
-        
-        # Map fields
-        if var_id in plans_map:
-            s["plan_name"] = plans_map[var_id]["name"]
-            s["amount"] = plans_map[var_id]["amount"]
-        else:
-            s["plan_name"] = "Unknown Plan"
-            s["amount"] = 0
-            
-        # Map next_billing_date from charged_through_date
-        s["next_billing_date"] = s.get("charged_through_date")
-        
-        enriched_subs.append(s)
+        plan = plans_map.get(sub.get("plan_variation_id"), unknown_plan)
+        enriched_subs.append({
+            **sub,
+            "plan_name": plan["name"],
+            "amount": plan["amount"],
+            # Map next_billing_date from charged_through_date
+            "next_billing_date": sub.get("charged_through_date")
+        })
         
     return {"success": True, "subscriptions": enriched_subs}
 
 @router.post("/pause-subscription")
-def pause_sub(user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def pause_sub(user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     if not user.square_subscription_id:
         raise HTTPException(status_code=404, detail="No active subscription found")
     
-    res = pause_subscription(user.square_subscription_id)
+    res = await run_in_threadpool(pause_subscription, user.square_subscription_id)
     if "errors" in res:
         raise HTTPException(status_code=400, detail=str(res["errors"]))
     
@@ -401,19 +426,19 @@ def pause_sub(user: Customer = Depends(get_db_user), db: Session = Depends(get_d
     log = SubscriptionLog(
         customer_id=user.id,
         subscription_id=user.square_subscription_id,
-        action="PAUSE",
-        effective_date=date.today()
+        action="PAUSE"
     )
     db.add(log)
-    db.commit()
+    await db.commit()
+    await invalidate_cached_user(user.id)
     return res
 
 @router.post("/resume-subscription")
-def resume_sub(user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def resume_sub(user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     if not user.square_subscription_id:
         raise HTTPException(status_code=404, detail="No active subscription found")
     
-    res = resume_subscription(user.square_subscription_id)
+    res = await run_in_threadpool(resume_subscription, user.square_subscription_id)
     if "errors" in res:
         raise HTTPException(status_code=400, detail=str(res["errors"]))
     
@@ -421,19 +446,19 @@ def resume_sub(user: Customer = Depends(get_db_user), db: Session = Depends(get_
     log = SubscriptionLog(
         customer_id=user.id,
         subscription_id=user.square_subscription_id,
-        action="RESUME",
-        effective_date=date.today()
+        action="RESUME"
     )
     db.add(log)
-    db.commit()
+    await db.commit()
+    await invalidate_cached_user(user.id)
     return res
 
 @router.post("/cancel-subscription")
-def cancel_sub(user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def cancel_sub(user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     if not user.square_subscription_id:
         raise HTTPException(status_code=404, detail="No active subscription found")
     
-    res = cancel_subscription(user.square_subscription_id)
+    res = await run_in_threadpool(cancel_subscription, user.square_subscription_id)
     if not res.get("success"):
         raise HTTPException(status_code=400, detail=res.get("error"))
     
@@ -442,113 +467,84 @@ def cancel_sub(user: Customer = Depends(get_db_user), db: Session = Depends(get_
     log = SubscriptionLog(
         customer_id=user.id,
         subscription_id=user.square_subscription_id,
-        action="CANCEL",
-        effective_date=date.today()
+        action="CANCEL"
     )
     db.add(log)
-    db.commit()
+    await db.commit()
+    await invalidate_cached_user(user.id)
     return res
 
 @router.post("/change-plan")
-def change_plan(request: ChangePlanRequest, user: Customer = Depends(get_db_user), db: Session = Depends(get_db)):
+async def change_plan(request: ChangePlanRequest, user: Customer = Depends(get_db_user), db: AsyncSession = Depends(get_db)):
     if not user.square_subscription_id:
         raise HTTPException(status_code=404, detail="No active subscription found")
     
-    res = update_subscription(user.square_subscription_id, request.new_plan_variation_id)
+    res = await run_in_threadpool(update_subscription, user.square_subscription_id, request.new_plan_variation_id)
     if not res.get("success"):
         raise HTTPException(status_code=400, detail=res.get("error"))
     
     return res
 
 @router.get("/billing-history")
-def billing_history(user: Customer = Depends(get_db_user)):
+async def billing_history(user: Customer = Depends(get_db_user)):
     if not user.square_customer_id:
         return {"success": True, "invoices": []}
     
-    res = get_customer_invoices(user.square_customer_id)
+    res = await run_in_threadpool(get_customer_invoices, user.square_customer_id)
     if not res.get("success"):
         return res
         
+    # Freshly parsed from Square and not shared, so enrich in place
     invoices = res.get("invoices", [])
-    enriched_invoices = []
     
     for inv in invoices:
-        i = inv.copy()
-        
-        amount = 0
-        if "payment_requests" in i and i["payment_requests"]:
-            for req in i["payment_requests"]:
-                 amount += int(req.get("computed_amount_money", {}).get("amount", 0))
+        amount = sum(
+            int(req.get("computed_amount_money", {}).get("amount", 0))
+            for req in inv.get("payment_requests") or ()
+        )
         
-        i["amount"] = amount / 100.0 # Convert to dollars
-        i["description"] = i.get("title") or i.get("description") or "Subscription Payment"
-        i["created_at"] = i.get("invoice_date") or i.get("scheduled_at") or i.get("created_at")
-             
-        enriched_invoices.append(i)
+        inv["amount"] = amount / 100.0 # Convert to dollars
+        inv["description"] = inv.get("title") or inv.get("description") or "Subscription Payment"
+        inv["created_at"] = inv.get("invoice_date") or inv.get("scheduled_at") or inv.get("created_at")
         
-    return {"success": True, "invoices": enriched_invoices}
+    return {"success": True, "invoices": invoices}
+
+INVOICE_BACKFILL_WINDOW = 60
 
 @router.get("/my-invoice-pdf/{square_invoice_id}")
-def download_my_invoice_pdf(
+async def download_my_invoice_pdf(
     square_invoice_id: str,
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
     user: Customer = Depends(get_db_user)
 ):
     from models.subscription import Invoice, SubscriptionPlan
     from utils.pdf_generator import generate_invoice_pdf
     
-    # Check local DB first
-    invoice = db.query(Invoice).filter(Invoice.square_invoice_id == square_invoice_id).first()
-    
+    invoice = await db.scalar(select(Invoice).where(Invoice.square_invoice_id == square_invoice_id))
+    if (
+        not invoice and user.square_customer_id
+        and await claim_once(f"invoice_backfill:{user.id}", INVOICE_BACKFILL_WINDOW)
+    ):
+        # The webhook stores only paid invoices, and older ones predate it.
+        # Backfill this customer's invoices from Square once so later
+        # downloads are a single lookup. At most one backfill per customer
+        # per window, so misses on made-up ids can't hammer Square.
+        res = await run_in_threadpool(get_customer_invoices, user.square_customer_id)
+        rows = [square_invoice_row(sq_inv, user.id) for sq_inv in res.get("invoices", [])]
+        if rows:
+            await db.execute(invoice_upsert(), rows)
+            await db.commit()
+            invoice = await db.scalar(select(Invoice).where(Invoice.square_invoice_id == square_invoice_id))
     if not invoice:
-        # If not in local DB, fetch from Square to support live testing for existing customers
-        res = get_customer_invoices(user.square_customer_id)
-        if not res.get("success"):
-            raise HTTPException(status_code=404, detail="Invoice not found")
-        
-        sq_inv = next((inv for inv in res.get("invoices", []) if inv.get("id") == square_invoice_id), None)
-        if not sq_inv:
-            raise HTTPException(status_code=404, detail="Invoice not found in Square")
-        
-        # Calculate amount from payment requests
-        amount = 0
-        if sq_inv.get("payment_requests"):
-            amount = int(sq_inv.get("payment_requests")[0].get("computed_amount_money", {}).get("amount", 0)) / 100.0
-        
-        # Parse dates safely
-        created_at_str = sq_inv.get("created_at")
-        due_date_str = sq_inv.get("scheduled_at") or created_at_str
-        
-        try:
-            created_at = datetime.fromisoformat(created_at_str.replace("Z", "+00:00"))
-            due_date = datetime.fromisoformat(due_date_str.replace("Z", "+00:00")).date()
-        except:
-            created_at = datetime.now()
-            due_date = created_at.date()
-
-        # Create mock object for the PDF generator
-        invoice = MockInvoice(
-            square_invoice_id=sq_inv.get("id"),
-            amount=amount,
-            status=sq_inv.get("status"),
-            created_at=created_at,
-            due_date=due_date
-        )
+        raise HTTPException(status_code=404, detail="Invoice not found")
 
     # Validate ownership
-    if getattr(invoice, 'customer_id', user.id) != user.id:
+    if invoice.customer_id != user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Get plan name
-    plan_name = "Subscription Service"
-    if user.plan_id:
-        try:
-            # Plan ID might be stored as string or int, handle carefully
-            plan_id_int = int(user.plan_id) if str(user.plan_id).isdigit() else 0
-            plan = db.query(SubscriptionPlan).filter(SubscriptionPlan.id == plan_id_int).first()
-            if plan:
-                plan_name = plan.plan_name
-        except:
-            pass
+    # Get plan name; user may come from the auth cache without its plan loaded
+    plan = await db.get(SubscriptionPlan, user.plan_id) if user.plan_id else None
+    plan_name = plan.plan_name if plan else "Subscription Service"
             
-    return generate_invoice_pdf(invoice, user, plan_name)
+    return await run_in_threadpool(generate_invoice_pdf, invoice, user, plan_name, if_none_match)
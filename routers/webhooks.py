@@ -1,125 +1,188 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
-from sqlalchemy.orm import Session
-from db.init import get_db
+from fastapi import APIRouter, BackgroundTasks, Request, HTTPException, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert
+from db.init import get_db, AsyncSessionLocal
 from models.user import Customer
-from models.subscription import Invoice, SubscriptionLog
-from datetime import date
+from models.subscription import Invoice, SubscriptionLog, WebhookEvent
+from utils.redis_client import claim_once
+from utils.deps import invalidate_cached_user
+from utils.invoices import square_invoice_row, invoice_upsert
+import base64
+import hashlib
+import hmac
 import logging
+import os
+import orjson
 from typing import Dict, Any
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Square stops redelivering an event well within a day
+WEBHOOK_DEDUP_TTL = 86400
+
+# Signature checks run when both are set; the URL must match the one
+# registered with Square exactly, since it is part of the signed payload.
+SQUARE_WEBHOOK_SIGNATURE_KEY = os.getenv("SQUARE_WEBHOOK_SIGNATURE_KEY", "")
+SQUARE_WEBHOOK_URL = os.getenv("SQUARE_WEBHOOK_URL", "")
+
+def is_valid_square_signature(body_bytes: bytes, signature: str) -> bool:
+    digest = hmac.new(
+        SQUARE_WEBHOOK_SIGNATURE_KEY.encode("utf-8"),
+        SQUARE_WEBHOOK_URL.encode("utf-8") + body_bytes,
+        hashlib.sha256
+    ).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode("ascii"), signature or "")
+
 @router.post("/square")
-async def square_webhook(request: Request, db: Session = Depends(get_db)):
+async def square_webhook(request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
     """
-    Handle Square Webhooks for Invoice Payment Failures and Successes
+    Handle Square Webhooks for Invoice Payment Failures and Successes.
+    The event is recorded and acknowledged right away; the customer
+    updates run after the response so Square doesn't time out and retry.
     """
+    body_bytes = await request.body()
+    if SQUARE_WEBHOOK_SIGNATURE_KEY and SQUARE_WEBHOOK_URL:
+        if not is_valid_square_signature(body_bytes, request.headers.get("x-square-hmacsha256-signature")):
+            logger.warning("Rejected Square Webhook with invalid signature")
+            raise HTTPException(status_code=403, detail="Invalid signature")
+
     try:
-        body_bytes = await request.body()
-        data = await request.json()
+        data = orjson.loads(body_bytes)
         
         # Determine event type
         event_type = data.get("type")
         event_id = data.get("event_id")
         
-        logger.info(f"Received Square Webhook: {event_type} - {event_id}")
+        logger.debug("Received Square Webhook: %s - %s", event_type, event_id)
+        
+        # Square redelivers with the same event_id; only the first delivery is processed.
+        # Redis turns most replays away without a DB write; webhook_events stays authoritative.
+        if event_id:
+            if not await claim_once(f"sq_evt:{event_id}", WEBHOOK_DEDUP_TTL):
+                logger.debug("Duplicate Square Webhook ignored: %s", event_id)
+                return {"status": "duplicate"}
+            recorded = await db.scalar(
+                insert(WebhookEvent)
+                .values(event_id=event_id, event_type=event_type, payload=body_bytes.decode("utf-8"))
+                .on_conflict_do_nothing(index_elements=["event_id"])
+                .returning(WebhookEvent.id)
+            )
+            await db.commit()
+            if recorded is None:
+                logger.debug("Duplicate Square Webhook ignored: %s", event_id)
+                return {"status": "duplicate"}
         
         if event_type == "invoice.payment_failed":
-            await handle_payment_failed(data, db)
+            background_tasks.add_task(handle_payment_failed, data)
         elif event_type == "invoice.payment_made": # Square calls it payment_made, not payment_succeeded for Invoices usually
              # Also check card payment success if needed, but for Subscriptions, its usually invoice related
-             await handle_payment_success(data, db)
+             background_tasks.add_task(handle_payment_success, data)
         
         return {"status": "success"}
 
     except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}")
+        logger.error("Error processing webhook: %s", e)
         # Return 200 to prevent Square from retrying indefinitely in case of logic error, but log it.
         # Check Square docs: usually 2xx is ack.
         return {"status": "error", "message": str(e)}
 
-async def handle_payment_failed(data: Dict[str, Any], db: Session):
-    try:
-        object_data = data.get("data", {}).get("object", {}).get("invoice", {})
-        square_customer_id = object_data.get("primary_recipient", {}).get("customer_id")
+async def handle_payment_failed(data: Dict[str, Any]):
+    # Runs as a background task after the request session is closed
+    async with AsyncSessionLocal() as db:
+        try:
+            object_data = data.get("data", {}).get("object", {}).get("invoice", {})
+            square_customer_id = object_data.get("primary_recipient", {}).get("customer_id")
         
-        if not square_customer_id:
-            logger.warning("No customer ID found in payment_failed webhook")
-            return
-
-        customer = db.query(Customer).filter(Customer.square_customer_id == square_customer_id).first()
-        if not customer:
-            logger.warning(f"Customer not found for Square ID: {square_customer_id}")
-            return
-
-        # Increment failure count
-        current_attempts = customer.failed_payment_attempts or 0
-        customer.failed_payment_attempts = current_attempts + 1
+            if not square_customer_id:
+                logger.warning("No customer ID found in payment_failed webhook")
+                return
+
+            # Increment failure count in SQL so concurrent deliveries can't lose an update
+            customer = (await db.execute(
+                update(Customer)
+                .where(Customer.square_customer_id == square_customer_id)
+                .values(failed_payment_attempts=func.coalesce(Customer.failed_payment_attempts, 0) + 1)
+                .returning(Customer.id, Customer.failed_payment_attempts, Customer.square_subscription_id)
+            )).first()
+            if not customer:
+                logger.warning("Customer not found for Square ID: %s", square_customer_id)
+                return
         
-        logger.info(f"Customer {customer.id} payment failed. Attempts: {customer.failed_payment_attempts}")
+            logger.debug("Customer %s payment failed. Attempts: %s", customer.id, customer.failed_payment_attempts)
 
-        # Suspension Rule: 3 failures
-        if customer.failed_payment_attempts >= 3 and customer.subscription_status != "SUSPENDED":
-            customer.subscription_status = "SUSPENDED"
-            customer.subscription_active = False
-            
-            # Log suspension
-            log = SubscriptionLog(
-                customer_id=customer.id,
-                subscription_id=customer.square_subscription_id,
-                action="SUSPEND",
-                effective_date=date.today()
-            )
-            db.add(log)
-            logger.warning(f"Customer {customer.id} SUSPENDED due to payment failures.")
+            # Suspension Rule: 3 failures. The status guard makes only one delivery suspend and log.
+            if customer.failed_payment_attempts >= 3:
+                suspended = (await db.execute(
+                    update(Customer)
+                    .where(Customer.id == customer.id, Customer.subscription_status.is_distinct_from("SUSPENDED"))
+                    .values(subscription_status="SUSPENDED", subscription_active=False)
+                    .returning(Customer.id)
+                )).first()
+                if suspended:
+                    # Log suspension
+                    log = SubscriptionLog(
+                        customer_id=customer.id,
+                        subscription_id=customer.square_subscription_id,
+                        action="SUSPEND"
+                    )
+                    db.add(log)
+                    logger.warning("Customer %s SUSPENDED due to payment failures.", customer.id)
 
-        db.commit()
-    except Exception as e:
-        logger.error(f"Error in handle_payment_failed: {e}")
-        db.rollback()
+            await db.commit()
+            await invalidate_cached_user(customer.id)
+        except Exception as e:
+            logger.error("Error in handle_payment_failed: %s", e)
+            await db.rollback()
 
-async def handle_payment_success(data: Dict[str, Any], db: Session):
-    try:
-        object_data = data.get("data", {}).get("object", {}).get("invoice", {})
-        square_customer_id = object_data.get("primary_recipient", {}).get("customer_id")
+async def handle_payment_success(data: Dict[str, Any]):
+    # Runs as a background task after the request session is closed
+    async with AsyncSessionLocal() as db:
+        try:
+            object_data = data.get("data", {}).get("object", {}).get("invoice", {})
+            square_customer_id = object_data.get("primary_recipient", {}).get("customer_id")
         
-        if not square_customer_id:
-             # Try getting it from payment object if invoice structure is different
-             # Square structure varies by event.
-             # fallback for "payment.created" or similar if needed.
-             pass
-
-        if not square_customer_id:
-             logger.warning("No customer ID found in payment_made webhook")
-             return
-
-        customer = db.query(Customer).filter(Customer.square_customer_id == square_customer_id).first()
-        if not customer:
-            logger.warning(f"Customer not found for Square ID: {square_customer_id}")
-            return
-
-        # Reset failures on success
-        if customer.failed_payment_attempts > 0:
-            customer.failed_payment_attempts = 0
-            logger.info(f"Customer {customer.id} payment success. Reset failures to 0.")
-
-        # Reactivate if suspended
-        if customer.subscription_status == "SUSPENDED":
-            customer.subscription_status = "ACTIVE"
-            customer.subscription_active = True
+            if not square_customer_id:
+                 # Try getting it from payment object if invoice structure is different
+                 # Square structure varies by event.
+                 # fallback for "payment.created" or similar if needed.
+                 pass
+
+            if not square_customer_id:
+                 logger.warning("No customer ID found in payment_made webhook")
+                 return
+
+            customer = await db.scalar(select(Customer).where(Customer.square_customer_id == square_customer_id))
+            if not customer:
+                logger.warning("Customer not found for Square ID: %s", square_customer_id)
+                return
+
+            # Keep a local copy of the paid invoice so PDF downloads never go to Square
+            if object_data.get("id"):
+                await db.execute(invoice_upsert(), square_invoice_row(object_data, customer.id))
+
+            # Reset failures on success
+            if customer.failed_payment_attempts > 0:
+                customer.failed_payment_attempts = 0
+                logger.debug("Customer %s payment success. Reset failures to 0.", customer.id)
+
+            # Reactivate if suspended
+            if customer.subscription_status == "SUSPENDED":
+                customer.subscription_status = "ACTIVE"
+                customer.subscription_active = True
             
-            # Log reactivation
-            log = SubscriptionLog(
-                customer_id=customer.id,
-                subscription_id=customer.square_subscription_id,
-                action="REACTIVATE",
-                effective_date=date.today()
-            )
-            db.add(log)
-            logger.info(f"Customer {customer.id} REACTIVATED after payment success.")
+                # Log reactivation
+                log = SubscriptionLog(
+                    customer_id=customer.id,
+                    subscription_id=customer.square_subscription_id,
+                    action="REACTIVATE"
+                )
+                db.add(log)
+                logger.info("Customer %s REACTIVATED after payment success.", customer.id)
         
-        db.commit()
-    except Exception as e:
-        logger.error(f"Error in handle_payment_success: {e}")
-        db.rollback()
+            await db.commit()
+            await invalidate_cached_user(customer.id)
+        except Exception as e:
+            logger.error("Error in handle_payment_success: %s", e)
+            await db.rollback()
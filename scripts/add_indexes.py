@@ -0,0 +1,36 @@
+from db.init import engine
+from sqlalchemy import text
+
+# Fresh databases get these from Base.metadata.create_all; this brings
+# existing databases in line.
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_customer_created_date ON customers (date(created_at))",
+    "CREATE INDEX IF NOT EXISTS ix_invoice_paid_created ON invoices (created_at) WHERE status = 'PAID'",
+    "CREATE INDEX IF NOT EXISTS ix_payment_customer_created ON payments (customer_id, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_customers_square_customer_id ON customers (square_customer_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payment_methods_customer_id ON payment_methods (customer_id)",
+    "CREATE INDEX IF NOT EXISTS ix_subscription_plans_plan_variation_id ON subscription_plans (plan_variation_id)",
+    # Older rows can carry several defaults per customer; keep the newest
+    # before the unique index goes on.
+    """
+    UPDATE payment_methods pm SET is_default = false
+    WHERE is_default AND EXISTS (
+        SELECT 1 FROM payment_methods newer
+        WHERE newer.customer_id = pm.customer_id AND newer.is_default AND newer.id > pm.id
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_pm_default ON payment_methods (customer_id) WHERE is_default",
+]
+
+def add_indexes():
+    try:
+        with engine.begin() as conn:
+            for ddl in INDEXES:
+                conn.execute(text(ddl))
+        print("Successfully ensured indexes")
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+        raise
+
+if __name__ == "__main__":
+    add_indexes()
@@ -1,14 +0,0 @@
-from db.init import engine
-from sqlalchemy import text
-
-def add_column():
-    with engine.connect() as conn:
-        try:
-            conn.execute(text("ALTER TABLE customers ADD COLUMN referral_number VARCHAR(50)"))
-            conn.commit()
-            print("Successfully added referral_number column")
-        except Exception as e:
-            print(f"Error (column might already exist): {e}")
-
-if __name__ == "__main__":
-    add_column()
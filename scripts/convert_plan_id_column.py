@@ -0,0 +1,46 @@
+from db.init import engine
+from sqlalchemy import text
+
+def convert_column():
+    try:
+        with engine.begin() as conn:
+            data_type = conn.execute(text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'customers' AND column_name = 'plan_id'"
+            )).scalar()
+            if data_type is None:
+                print("customers table not found; create_all will build it with an integer plan_id")
+                return
+            if data_type == "integer":
+                print("plan_id is already an integer foreign key")
+                return
+
+            # plan_id used to be a free-form string, mostly slugs like "basic".
+            # Map slugs to plan ids the way signup resolves them (first word of
+            # the plan name, lowest id wins), then keep numeric ids, drop the rest
+            conn.execute(text(
+                "UPDATE customers c SET plan_id = sp.id::text "
+                "FROM (SELECT DISTINCT ON (slug) id, slug FROM ("
+                "    SELECT id, lower(split_part(plan_name, ' ', 1)) AS slug FROM subscription_plans"
+                ") named ORDER BY slug, id) sp "
+                "WHERE c.plan_id !~ '^[0-9]+$' AND lower(c.plan_id) = sp.slug"
+            ))
+            conn.execute(text(
+                "ALTER TABLE customers ALTER COLUMN plan_id TYPE INTEGER "
+                "USING CASE WHEN plan_id ~ '^[0-9]+$' THEN plan_id::integer END"
+            ))
+            conn.execute(text(
+                "UPDATE customers SET plan_id = NULL "
+                "WHERE plan_id IS NOT NULL AND plan_id NOT IN (SELECT id FROM subscription_plans)"
+            ))
+            conn.execute(text(
+                "ALTER TABLE customers ADD CONSTRAINT customers_plan_id_fkey "
+                "FOREIGN KEY (plan_id) REFERENCES subscription_plans (id)"
+            ))
+        print("Successfully converted plan_id to an integer foreign key")
+    except Exception as e:
+        print(f"Error converting column: {e}")
+        raise
+
+if __name__ == "__main__":
+    convert_column()
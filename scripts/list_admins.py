@@ -1,35 +1,34 @@
 """
 List all admin users in the database
 """
-import sys
-import os
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from sqlalchemy.orm import Session
-from db.init import SessionLocal
+from sqlalchemy import select
+from db.init import session_scope
 from models.user import Admin
 
 def list_admins():
-    db = SessionLocal()
     try:
-        admins = db.query(Admin).all()
-        if not admins:
-            print("No admins found in database")
-            return
-        
-        print(f"Found {len(admins)} admin(s):")
-        for admin in admins:
-            print(f"  - Email: {admin.email}")
-            print(f"    Name: {admin.name}")
-            print(f"    ID: {admin.id}")
-            print()
+        with session_scope() as db:
+            # Only the printed columns, streamed through a server-side cursor
+            # in batches of 1000 rather than loaded all at once
+            admins = db.execute(
+                select(Admin.id, Admin.email, Admin.name).execution_options(yield_per=1000)
+            )
+            count = 0
+            for admin in admins:
+                count += 1
+                print(f"  - Email: {admin.email}")
+                print(f"    Name: {admin.name}")
+                print(f"    ID: {admin.id}")
+                print()
+
+            if not count:
+                print("No admins found in database")
+                return
+            print(f"Found {count} admin(s)")
     except Exception as e:
         print(f"Error: {e}")
         import traceback
         traceback.print_exc()
-    finally:
-        db.close()
 
 if __name__ == "__main__":
     list_admins()
@@ -0,0 +1,28 @@
+from db.init import engine
+from sqlalchemy import text
+
+# Column changes made after the first deploy, one ALTER per table.
+# Fresh databases get all of this from Base.metadata.create_all.
+MIGRATIONS = [
+    "ALTER TABLE customers "
+    "ADD COLUMN IF NOT EXISTS failed_payment_attempts INTEGER DEFAULT 0, "
+    "ADD COLUMN IF NOT EXISTS referral_number VARCHAR(50)",
+    # Audit rows may have no Square subscription and take their effective date from the database clock
+    "ALTER TABLE subscription_logs "
+    "ALTER COLUMN subscription_id DROP NOT NULL, "
+    "ALTER COLUMN effective_date SET DEFAULT CURRENT_DATE",
+]
+
+def migrate_schema():
+    try:
+        with engine.begin() as conn:
+            for ddl in MIGRATIONS:
+                conn.execute(text(ddl))
+        print("Successfully migrated schema")
+    except Exception as e:
+        # Every statement is idempotent, so any error here is a real failure
+        print(f"Error migrating schema: {e}")
+        raise
+
+if __name__ == "__main__":
+    migrate_schema()
@@ -1,14 +1,12 @@
 """
 Test script to verify admin login credentials
-"""
-import sys
-import os
-
-# Add the parent directory to sys.path to allow importing from backend modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from sqlalchemy.orm import Session
-from db.init import SessionLocal
+Verification runs at the cost stored in the hash. For fast dev/CI runs,
+create the admin with a low cost first, e.g.
+    PBKDF2_ROUNDS=1000 python -m scripts.create_admin
+"""
+from sqlalchemy import select
+from db.init import session_scope
 from models.user import Admin
 from utils.security import verify_password, hash_password
 
@@ -16,50 +14,50 @@ def test_admin_login():
     email = "admin@adamspropertycare.com"
     password = "admin123"
     
-    db = SessionLocal()
     try:
-        admin = db.query(Admin).filter(Admin.email == email).first()
+        with session_scope() as db:
+            admin = db.execute(
+                select(Admin.id, Admin.email, Admin.name, Admin.password_hash).where(Admin.email == email)
+            ).first()
         
-        if not admin:
-            print(f"[ERROR] Admin with email {email} not found in database")
-            print("\nAvailable admins in database:")
-            all_admins = db.query(Admin).all()
-            if all_admins:
-                for a in all_admins:
-                    print(f"  - {a.email} (ID: {a.id}, Name: {a.name})")
-            else:
-                print("  No admins found in database")
-            return False
+            if not admin:
+                print(f"[ERROR] Admin with email {email} not found in database")
+                print("\nAvailable admins in database:")
+                all_admins = db.execute(select(Admin.id, Admin.email, Admin.name)).all()
+                if all_admins:
+                    for a in all_admins:
+                        print(f"  - {a.email} (ID: {a.id}, Name: {a.name})")
+                else:
+                    print("  No admins found in database")
+                return False
         
-        print(f"[OK] Admin found: {admin.email}")
-        print(f"  Name: {admin.name}")
-        print(f"  ID: {admin.id}")
-        print(f"  Password hash: {admin.password_hash[:50]}...")
+            print(f"[OK] Admin found: {admin.email}")
+            print(f"  Name: {admin.name}")
+            print(f"  ID: {admin.id}")
+            print(f"  Password hash: {admin.password_hash[:50]}...")
         
-        # Test password verification
-        print(f"\nTesting password verification...")
-        print(f"  Input password: {password}")
-        print(f"  Stored hash: {admin.password_hash[:50]}...")
+            # Test password verification
+            print(f"\nTesting password verification...")
+            print(f"  Input password: {password}")
+            print(f"  Stored hash: {admin.password_hash[:50]}...")
         
-        is_valid = verify_password(password, admin.password_hash)
+            is_valid = verify_password(password, admin.password_hash)
         
-        if is_valid:
-            print("[OK] Password verification: SUCCESS")
-            return True
-        else:
-            print("[ERROR] Password verification: FAILED")
-            print("\nThe password hash might be incorrect.")
-            print("Try recreating the admin with:")
-            print("  python scripts/create_admin.py")
-            return False
+            if is_valid:
+                print("[OK] Password verification: SUCCESS")
+                return True
+            else:
+                print("[ERROR] Password verification: FAILED")
+                print("\nThe password hash might be incorrect.")
+                print("Try recreating the admin with:")
+                print("  python -m scripts.create_admin")
+                return False
             
     except Exception as e:
         print(f"[ERROR] Error: {e}")
         import traceback
         traceback.print_exc()
         return False
-    finally:
-        db.close()
 
 if __name__ == "__main__":
     test_admin_login()
@@ -1,9 +1,11 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 from db.init import get_db
 from models.user import Customer
+from utils.redis_client import cache_get_many, cache_set, cache_incr
 import os
 
 security = HTTPBearer()
@@ -11,6 +13,35 @@ security = HTTPBearer()
 SECRET_KEY = os.getenv("JWT_SECRET", "supersecretkey")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 
+# Customer columns kept in the Redis user cache. password_hash never leaves
+# the database; created_at isn't read by any authenticated route.
+# A cache hit hands routes a Customer with only these columns loaded and the
+# plan relationship unloaded. Touching anything else triggers a lazy
+# load, which raises MissingGreenlet on the async session: routes that need
+# more must query it explicitly (e.g. db.get(SubscriptionPlan, user.plan_id)).
+USER_CACHE_TTL = 300
+CACHED_USER_FIELDS = (
+    "id", "first_name", "last_name", "address", "phone_number", "email",
+    "city", "state", "zip_code", "referral_number", "failed_payment_attempts",
+    "square_customer_id", "square_subscription_id", "subscription_active",
+    "subscription_status", "plan_id", "plan_variation_id",
+)
+
+def user_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def user_generation_key(user_id: int) -> str:
+    return f"user_gen:{user_id}"
+
+async def invalidate_cached_user(user_id: int) -> None:
+    """
+    Call after committing any change to a customer row. Bumps the user's
+    generation, so cached copies (and fills racing this call) stop matching.
+    Generations never expire: a counter that restarted could match an entry
+    written under an earlier run of the same numbers.
+    """
+    await cache_incr(user_generation_key(user_id))
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
@@ -22,9 +53,23 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_db_user(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_db_user(current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     user_id = current_user.get("id")
-    user = db.query(Customer).filter(Customer.id == user_id).first()
+    cached, generation = await cache_get_many([user_cache_key(user_id), user_generation_key(user_id)])
+    if cached is not None and cached.pop("gen", None) == generation:
+        # Attach the cached row to this session without a SELECT; routes can
+        # still modify and commit it as usual. Uncached attributes and
+        # relationships are left unloaded (see CACHED_USER_FIELDS).
+        user = Customer(**cached)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    user = await db.get(Customer, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    # Tagged with the generation read before the SELECT: if the row was
+    # invalidated meanwhile, this entry never matches and is ignored
+    entry = {f: getattr(user, f) for f in CACHED_USER_FIELDS}
+    entry["gen"] = generation
+    await cache_set(user_cache_key(user_id), entry, USER_CACHE_TTL)
     return user
@@ -0,0 +1,54 @@
+"""
+Mapping Square invoice payloads onto local Invoice rows.
+Shared by the admin invoice sync and the payment webhook.
+"""
+from datetime import datetime
+from typing import Any, Dict
+import ciso8601
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+
+from models.subscription import Invoice
+
+def square_invoice_row(sq_inv: Dict[str, Any], customer_id: int) -> Dict[str, Any]:
+    """Invoice column values for one Square invoice object."""
+    amount_data = {}
+    if sq_inv.get("payment_requests"):
+        amount_data = sq_inv.get("payment_requests")[0].get("computed_amount_money", {})
+    if not amount_data.get("amount") and sq_inv.get("next_payment_amount_money"):
+         amount_data = sq_inv.get("next_payment_amount_money")
+
+    amount = float(amount_data.get("amount", 0)) / 100.0
+
+    due_date_str = sq_inv.get("scheduled_at") or sq_inv.get("created_at")
+    try:
+        # Handles both full RFC 3339 timestamps and bare YYYY-MM-DD dates
+        due_date = ciso8601.parse_datetime(due_date_str).date() if due_date_str else datetime.now().date()
+    except ValueError:
+        due_date = datetime.now().date()
+
+    return dict(
+        square_invoice_id=sq_inv.get("id"),
+        customer_id=customer_id,
+        subscription_id=sq_inv.get("subscription_id"),
+        amount=amount,
+        status=sq_inv.get("status"),
+        due_date=due_date,
+        public_url=sq_inv.get("public_url")
+    )
+
+def invoice_upsert():
+    """
+    INSERT ... ON CONFLICT (square_invoice_id) DO UPDATE for Invoice rows,
+    returning xmax = 0, which is true only for freshly inserted rows.
+    Execute with one row dict or a list of them.
+    """
+    stmt = insert(Invoice)
+    return stmt.on_conflict_do_update(
+        index_elements=["square_invoice_id"],
+        set_={
+            "status": stmt.excluded.status,
+            "public_url": stmt.excluded.public_url,
+            "amount": stmt.excluded.amount
+        }
+    ).returning(literal_column("xmax = 0"))
@@ -1,9 +1,94 @@
 from fpdf import FPDF
+import hashlib
+import os
 import tempfile
+from fastapi import Response
 from fastapi.responses import FileResponse
 from datetime import datetime
 
-def generate_invoice_pdf(invoice, customer, plan_name="Subscription Service"):
+# Rendered invoices are cached on disk, keyed by a hash of everything drawn on the page
+PDF_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pdf_cache")
+PDF_CACHE_MAX_FILES = 500
+
+def invoice_pdf_etag(invoice, customer, plan_name):
+    fingerprint = "|".join(str(v) for v in (
+        invoice.square_invoice_id,
+        invoice.status,
+        invoice.amount,
+        invoice.due_date,
+        invoice.created_at,
+        customer.first_name,
+        customer.last_name,
+        customer.address,
+        customer.city,
+        customer.zip_code,
+        plan_name,
+    ))
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header lists etag (weak or strong) or is *."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+def generate_invoice_pdf(invoice, customer, plan_name="Subscription Service", if_none_match=None):
+    etag = invoice_pdf_etag(invoice, customer, plan_name)
+    # The PDF changes when the invoice does (e.g. UNPAID -> PAID), so clients
+    # must revalidate every time; an unchanged invoice costs a 304
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = os.path.join(PDF_CACHE_DIR, f"{etag}.pdf")
+    try:
+        # Touch so the sweep evicts least recently served files first
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=PDF_CACHE_DIR, delete=False, suffix=".tmp") as tmp:
+            tmp_path = tmp.name
+        try:
+            render_invoice_pdf(invoice, customer, plan_name, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        sweep_pdf_cache(keep=path)
+
+    return FileResponse(path, filename=f"Adams_Invoice_{invoice.square_invoice_id}.pdf", media_type="application/pdf", headers=headers)
+
+def sweep_pdf_cache(keep=None):
+    """
+    Trim the cache to PDF_CACHE_MAX_FILES, oldest first. keep is the file
+    about to be served; files other requests are serving were just touched,
+    so they sort newest and go last.
+    """
+    entries = []
+    for entry in os.scandir(PDF_CACHE_DIR):
+        if not entry.name.endswith(".pdf") or entry.path == keep:
+            continue
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            # Already removed by a concurrent sweep
+            pass
+    if len(entries) < PDF_CACHE_MAX_FILES:
+        return
+    entries.sort()
+    for _, entry_path in entries[:len(entries) + 1 - PDF_CACHE_MAX_FILES]:
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+def render_invoice_pdf(invoice, customer, plan_name, path):
     pdf = FPDF()
     pdf.add_page()
     
@@ -97,7 +182,4 @@ def generate_invoice_pdf(invoice, customer, plan_name="Subscription Service"):
     pdf.set_font("Helvetica", "", 8)
     pdf.cell(0, 5, "This is a computer-generated document. No signature required.", align="C")
     
-    # Save to temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        pdf.output(tmp.name)
-        return FileResponse(tmp.name, filename=f"Adams_Invoice_{invoice.square_invoice_id}.pdf", media_type="application/pdf")
+    pdf.output(path)
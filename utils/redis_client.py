@@ -0,0 +1,75 @@
+"""
+Optional Redis connection shared by the app.
+Redis is only used when REDIS_URL is set; every helper degrades to a no-op
+otherwise so the database stays the source of truth.
+"""
+import os
+import logging
+import orjson
+from typing import Any, List, Optional
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+redis: Optional[aioredis.Redis] = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+
+async def claim_once(key: str, ttl: int) -> bool:
+    """
+    SET key NX with a TTL. Returns False only when Redis confirms the key
+    was already claimed; if Redis is unset or unreachable the caller proceeds.
+    """
+    if redis is None:
+        return True
+    try:
+        return bool(await redis.set(key, "1", nx=True, ex=ttl))
+    except Exception as e:
+        logger.warning("Redis unavailable for %s: %s", key, e)
+        return True
+
+async def cache_get(key: str) -> Optional[Any]:
+    """Cached JSON value for key, or None on a miss or when Redis is unavailable."""
+    if redis is None:
+        return None
+    try:
+        raw = await redis.get(key)
+    except Exception as e:
+        logger.warning("Redis unavailable for %s: %s", key, e)
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+async def cache_get_many(keys: List[str]) -> List[Optional[Any]]:
+    """cache_get for several keys in one MGET round trip."""
+    if redis is None:
+        return [None] * len(keys)
+    try:
+        raws = await redis.mget(keys)
+    except Exception as e:
+        logger.warning("Redis unavailable for %s: %s", keys, e)
+        return [None] * len(keys)
+    return [orjson.loads(raw) if raw is not None else None for raw in raws]
+
+async def cache_set(key: str, value: Any, ttl: int) -> None:
+    if redis is None:
+        return
+    try:
+        await redis.set(key, orjson.dumps(value), ex=ttl)
+    except Exception as e:
+        logger.warning("Redis unavailable for %s: %s", key, e)
+
+async def cache_incr(key: str) -> None:
+    if redis is None:
+        return
+    try:
+        await redis.incr(key)
+    except Exception as e:
+        logger.warning("Redis unavailable for %s: %s", key, e)
+
+async def cache_delete(key: str) -> None:
+    if redis is None:
+        return
+    try:
+        await redis.delete(key)
+    except Exception as e:
+        logger.warning("Redis unavailable for %s: %s", key, e)
@@ -3,10 +3,16 @@ from jose import jwt, JWTError
 from datetime import datetime, timedelta
 import os
 
+# Work factor for new hashes. Tune so one hash takes a few hundred ms on the
+# production host; existing hashes keep verifying at whatever cost they were
+# created with. Dev/CI can set it low to make seeded logins cheap.
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+
 pwd_context = CryptContext(
     schemes=["pbkdf2_sha256", "bcrypt"],
     default="pbkdf2_sha256",
     deprecated="auto",
+    pbkdf2_sha256__rounds=PBKDF2_ROUNDS,
 )
 
 SECRET_KEY = os.getenv("JWT_SECRET", "supersecretkey")
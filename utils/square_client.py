@@ -5,8 +5,12 @@ Handles all Square API interactions for payment processing and subscription mana
 import os
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
 import uuid
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +25,15 @@ SQUARE_API_BASE_URL = {
     "production": "https://connect.squareup.com"
 }
 
+# Shared connection pool so repeated calls reuse TCP/TLS connections to Square.
+# Retries only apply to idempotent methods (urllib3's default allow-list).
+square_session = requests.Session()
+square_session.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+
 def get_square_base_url() -> str:
     """Get the base URL for Square API based on environment"""
     return SQUARE_API_BASE_URL.get(SQUARE_ENVIRONMENT, SQUARE_API_BASE_URL["sandbox"])
@@ -62,10 +75,10 @@ def process_payment(
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         return response.json()
     except Exception as e:
-        logger.error(f"Error processing payment: {str(e)}")
+        logger.error("Error processing payment: %s", e)
         return {"errors": [{"detail": str(e)}]}
 
 def get_payment_status(transaction_id: str) -> Dict[str, Any]:
@@ -73,10 +86,10 @@ def get_payment_status(transaction_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/payments/{transaction_id}"
         headers = get_square_headers()
-        response = requests.get(url, headers=headers, timeout=10)
+        response = square_session.get(url, headers=headers, timeout=10)
         return response.json()
     except Exception as e:
-        logger.error(f"Error getting payment status: {str(e)}")
+        logger.error("Error getting payment status: %s", e)
         return {"errors": [{"detail": str(e)}]}
 
 # --- Customer Operations ---
@@ -101,14 +114,14 @@ def create_square_customer(
         if phone_number: payload["phone_number"] = phone_number
         if address: payload["address"] = address
         
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         data = response.json()
         
         if "customer" in data:
             return {"success": True, "customer": data["customer"], "customer_id": data["customer"]["id"]}
         return {"success": False, "error": str(data.get("errors", "Unknown error"))}
     except Exception as e:
-        logger.error(f"Error creating customer: {str(e)}")
+        logger.error("Error creating customer: %s", e)
         return {"success": False, "error": str(e)}
 
 def get_square_customer_by_id(customer_id: str) -> Dict[str, Any]:
@@ -116,7 +129,7 @@ def get_square_customer_by_id(customer_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/customers/{customer_id}"
         headers = get_square_headers()
-        response = requests.get(url, headers=headers, timeout=10)
+        response = square_session.get(url, headers=headers, timeout=10)
         data = response.json()
         if "customer" in data:
             return {"success": True, "customer": data["customer"]}
@@ -130,7 +143,7 @@ def get_square_customer_by_email(email: str) -> Dict[str, Any]:
         url = f"{get_square_base_url()}/v2/customers/search"
         headers = get_square_headers()
         payload = {"query": {"filter": {"email_address": {"exact": email}}}}
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         data = response.json()
         customers = data.get("customers", [])
         if customers:
@@ -144,13 +157,13 @@ def update_square_customer(customer_id: str, **kwargs) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/customers/{customer_id}"
         headers = get_square_headers()
-        response = requests.put(url, json=kwargs, headers=headers, timeout=10)
+        response = square_session.put(url, json=kwargs, headers=headers, timeout=10)
         data = response.json()
         if "customer" in data:
             return {"success": True, "customer": data["customer"]}
         return {"success": False, "error": str(data.get("errors", "Unknown error"))}
     except Exception as e:
-        logger.error(f"Error updating customer: {str(e)}")
+        logger.error("Error updating customer: %s", e)
         return {"success": False, "error": str(e)}
 
 # --- Card Operations ---
@@ -183,11 +196,11 @@ def create_card_on_file(source_id: str, customer_id: str, idempotency_key: Optio
             }
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         
         if response.status_code not in [200, 201]:
             error_text = response.text
-            logger.error(f"Square Create Card API error: {response.status_code} - {error_text}")
+            logger.error("Square Create Card API error: %s - %s", response.status_code, error_text)
             try:
                 error_data = response.json()
                 errors = error_data.get("errors", [])
@@ -216,7 +229,7 @@ def create_card_on_file(source_id: str, customer_id: str, idempotency_key: Optio
             
             # Verify association
             if not card_customer_id or card_customer_id != customer_id:
-                logger.error(f"CRITICAL: Card {card_id} created but not associated with customer {customer_id}")
+                logger.error("CRITICAL: Card %s created but not associated with customer %s", card_id, customer_id)
                 return {
                     "success": False,
                     "error": f"Card created but not associated with customer. Expected {customer_id}, got {card_customer_id}",
@@ -236,7 +249,7 @@ def create_card_on_file(source_id: str, customer_id: str, idempotency_key: Optio
         return {"success": False, "error": "No card data in response"}
             
     except Exception as e:
-        logger.error(f"Error creating card on file: {str(e)}")
+        logger.error("Error creating card on file: %s", e)
         return {"success": False, "error": str(e), "card_id": None}
 
 def get_customer_cards(customer_id: str) -> Dict[str, Any]:
@@ -245,16 +258,16 @@ def get_customer_cards(customer_id: str) -> Dict[str, Any]:
         url = f"{get_square_base_url()}/v2/cards?customer_id={customer_id}"
         headers = get_square_headers()
         
-        response = requests.get(url, headers=headers, timeout=10)
+        response = square_session.get(url, headers=headers, timeout=10)
         
         if response.status_code not in [200, 201]:
-            logger.error(f"Square List Cards Error: {response.status_code} - {response.text}")
+            logger.error("Square List Cards Error: %s - %s", response.status_code, response.text)
             return {"success": False, "error": response.text, "cards": []}
         
         data = response.json()
         return {"success": True, "cards": data.get("cards", [])}
     except Exception as e:
-        logger.error(f"Error fetching customer cards: {str(e)}")
+        logger.error("Error fetching customer cards: %s", e)
         return {"success": False, "error": str(e)}
 
 def disable_card(card_id: str) -> Dict[str, Any]:
@@ -262,13 +275,13 @@ def disable_card(card_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/cards/{card_id}/disable"
         headers = get_square_headers()
-        response = requests.post(url, headers=headers, timeout=10)
+        response = square_session.post(url, headers=headers, timeout=10)
         data = response.json()
         if "card" in data:
             return {"success": True, "card": data["card"]}
         return {"success": False, "error": str(data.get("errors", "Unknown error"))}
     except Exception as e:
-        logger.error(f"Error disabling card: {str(e)}")
+        logger.error("Error disabling card: %s", e)
         return {"success": False, "error": str(e)}
 
 # --- Catalog Operations ---
@@ -279,7 +292,7 @@ def get_catalog_objects(types: Optional[List[str]] = None) -> Dict[str, Any]:
         url = f"{get_square_base_url()}/v2/catalog/list"
         headers = get_square_headers()
         params = {"types": ",".join(types)} if types else {}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = square_session.get(url, params=params, headers=headers, timeout=10)
         return response.json()
     except Exception as e:
         return {"errors": [{"detail": str(e)}]}
@@ -290,7 +303,7 @@ def get_subscription_plans() -> Dict[str, Any]:
         url = f"{get_square_base_url()}/v2/catalog/list"
         headers = get_square_headers()
         params = {"types": "SUBSCRIPTION_PLAN,SUBSCRIPTION_PLAN_VARIATION"}
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = square_session.get(url, params=params, headers=headers, timeout=10)
         data = response.json()
         
         plans = []
@@ -343,7 +356,7 @@ def create_subscription(
         }
         if start_date: payload["start_date"] = start_date
         
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = square_session.post(url, json=payload, headers=headers, timeout=15)
         data = response.json()
         if "subscription" in data:
             return {"success": True, "subscription": data["subscription"], "subscription_id": data["subscription"]["id"]}
@@ -369,7 +382,7 @@ def get_subscriptions(customer_id: Optional[str] = None, status: Optional[str] =
         if cursor:
             payload["cursor"] = cursor
         
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         
         if response.status_code != 200:
             return {"success": False, "error": response.text, "subscriptions": []}
@@ -381,9 +394,104 @@ def get_subscriptions(customer_id: Optional[str] = None, status: Optional[str] =
             "cursor": data.get("cursor")
         }
     except Exception as e:
-        logger.error(f"Error fetching subscriptions: {str(e)}")
+        logger.error("Error fetching subscriptions: %s", e)
         return {"success": False, "error": str(e)}
 
+# --- Cached Reads ---
+# Admin dashboards request the same Square listings on every page load.
+# Successful responses are memoized briefly; failures are never cached.
+
+_subscriptions_cache = TTLCache(maxsize=128, ttl=30)
+_plans_cache = TTLCache(maxsize=1, ttl=300)
+_variation_map_cache = TTLCache(maxsize=1, ttl=300)
+_plans_map_cache = TTLCache(maxsize=1, ttl=300)
+_cache_lock = threading.Lock()
+
+def _cached_call(cache: TTLCache, key: Any, fetch: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    with _cache_lock:
+        hit = cache.get(key)
+    if hit is not None:
+        return hit
+    result = fetch()
+    if result.get("success"):
+        with _cache_lock:
+            cache[key] = result
+    return result
+
+def cached_subscriptions(status: Optional[str] = "ACTIVE") -> Dict[str, Any]:
+    """get_subscriptions(status=...) memoized for 30 seconds."""
+    return _cached_call(_subscriptions_cache, status, lambda: get_subscriptions(status=status))
+
+def cached_subscription_plans() -> Dict[str, Any]:
+    """get_subscription_plans() memoized for 5 minutes."""
+    return _cached_call(_plans_cache, "plans", get_subscription_plans)
+
+def get_variation_map() -> Dict[str, Dict[str, Any]]:
+    """
+    Map plan variation ID -> {"name": plan name, "price": monthly price in dollars}.
+    Built from the cached catalog and kept for 5 minutes.
+    """
+    with _cache_lock:
+        hit = _variation_map_cache.get("map")
+    if hit is not None:
+        return hit
+
+    plans_res = cached_subscription_plans()
+    variation_map = {}
+    for p in plans_res.get("plans", []):
+        p_name = p.get("name", "Unknown Plan")
+        for v in p.get("variations", []):
+            phases = v.get("phases", [])
+            price = 0.0
+            if phases:
+                amount_money = phases[0].get("recurring_price_money", {})
+                price = float(amount_money.get("amount", 0)) / 100.0
+            variation_map[v.get("id")] = {"name": p_name, "price": price}
+
+    if plans_res.get("success"):
+        with _cache_lock:
+            _variation_map_cache["map"] = variation_map
+    return variation_map
+
+def get_plans_map() -> Dict[str, Dict[str, Any]]:
+    """
+    Map plan variation ID -> {"name": "Plan - Variation", "amount": price in cents},
+    the shape the customer dashboard shows. Built from the cached catalog and
+    kept for 5 minutes.
+    """
+    with _cache_lock:
+        hit = _plans_map_cache.get("map")
+    if hit is not None:
+        return hit
+
+    plans_res = cached_subscription_plans()
+    # Price comes from the first phase, 0 when the variation has none
+    plans_map = {
+        v["id"]: {
+            "name": f"{p['name']} - {v['name']}",
+            "amount": int((v.get("phases") or [{}])[0].get("recurring_price_money", {}).get("amount", 0))
+        }
+        for p in plans_res.get("plans", [])
+        for v in p.get("variations", [])
+    }
+
+    if plans_res.get("success"):
+        with _cache_lock:
+            _plans_map_cache["map"] = plans_map
+    return plans_map
+
+def invalidate_plan_cache() -> None:
+    """Drop the cached catalog and everything derived from it."""
+    with _cache_lock:
+        _plans_cache.clear()
+        _variation_map_cache.clear()
+        _plans_map_cache.clear()
+
+def invalidate_subscription_cache() -> None:
+    """Drop cached subscription listings after a subscription is mutated."""
+    with _cache_lock:
+        _subscriptions_cache.clear()
+
 def search_subscriptions(status: Optional[str] = None) -> Dict[str, Any]:
     """
     Compatibility wrapper for admin.py using get_subscriptions.
@@ -395,7 +503,7 @@ def cancel_subscription(subscription_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/subscriptions/{subscription_id}/cancel"
         headers = get_square_headers()
-        response = requests.post(url, headers=headers, timeout=10)
+        response = square_session.post(url, headers=headers, timeout=10)
         data = response.json()
         if "subscription" in data:
             return {"success": True, "subscription": data["subscription"]}
@@ -408,7 +516,7 @@ def retrieve_subscription(subscription_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/subscriptions/{subscription_id}"
         headers = get_square_headers()
-        response = requests.get(url, headers=headers, timeout=10)
+        response = square_session.get(url, headers=headers, timeout=10)
         data = response.json()
         if "subscription" in data:
             return {"success": True, "subscription": data["subscription"]}
@@ -422,7 +530,7 @@ def update_subscription(subscription_id: str, plan_variation_id: str) -> Dict[st
         url = f"{get_square_base_url()}/v2/subscriptions/{subscription_id}/swap-plan"
         headers = get_square_headers()
         payload = {"new_plan_variation_id": plan_variation_id}
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         data = response.json()
         if "subscription" in data:
             return {"success": True, "subscription": data["subscription"]}
@@ -441,13 +549,13 @@ def update_subscription_card(subscription_id: str, card_id: str) -> Dict[str, An
             }
         }
         # Note: According to Square API, this is a PUT to update the subscription
-        response = requests.put(url, json=payload, headers=headers, timeout=10)
+        response = square_session.put(url, json=payload, headers=headers, timeout=10)
         data = response.json()
         if "subscription" in data:
             return {"success": True, "subscription": data["subscription"]}
         return {"success": False, "error": str(data.get("errors", "Unknown error"))}
     except Exception as e:
-        logger.error(f"Error updating subscription card: {str(e)}")
+        logger.error("Error updating subscription card: %s", e)
         return {"success": False, "error": str(e)}
 
 def pause_subscription(subscription_id: str) -> Dict[str, Any]:
@@ -455,7 +563,7 @@ def pause_subscription(subscription_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/subscriptions/{subscription_id}/pause"
         headers = get_square_headers()
-        response = requests.post(url, json={}, headers=headers, timeout=10)
+        response = square_session.post(url, json={}, headers=headers, timeout=10)
         return response.json()
     except Exception as e:
         return {"errors": [{"detail": str(e)}]}
@@ -465,7 +573,7 @@ def resume_subscription(subscription_id: str) -> Dict[str, Any]:
     try:
         url = f"{get_square_base_url()}/v2/subscriptions/{subscription_id}/resume"
         headers = get_square_headers()
-        response = requests.post(url, json={}, headers=headers, timeout=10)
+        response = square_session.post(url, json={}, headers=headers, timeout=10)
         return response.json()
     except Exception as e:
         return {"errors": [{"detail": str(e)}]}
@@ -497,7 +605,7 @@ def get_customer_invoices(customer_id: str, location_id: Optional[str] = None, l
         if limit:
             payload["limit"] = limit
             
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         
         if response.status_code != 200:
             return {"success": False, "error": response.text, "invoices": []}
@@ -509,7 +617,7 @@ def get_customer_invoices(customer_id: str, location_id: Optional[str] = None, l
             "errors": data.get("errors", [])
         }
     except Exception as e:
-        logger.error(f"Error fetching invoices: {str(e)}")
+        logger.error("Error fetching invoices: %s", e)
         return {"success": False, "error": str(e)}
 def search_invoices(customer_id: str, location_id: Optional[str] = None) -> Dict[str, Any]:
     """Search for invoices belonging to a specific customer using Square Invoices API."""
@@ -531,7 +639,7 @@ def search_invoices(customer_id: str, location_id: Optional[str] = None) -> Dict
             }
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         data = response.json()
         
         if response.status_code == 200:
@@ -539,7 +647,7 @@ def search_invoices(customer_id: str, location_id: Optional[str] = None) -> Dict
         
         return {"success": False, "error": str(data.get("errors", "Unknown error fetching invoices"))}
     except Exception as e:
-        logger.error(f"Error searching invoices: {str(e)}")
+        logger.error("Error searching invoices: %s", e)
         return {"success": False, "error": str(e)}
 
 def list_recent_invoices(limit: int = 5, location_id: Optional[str] = None) -> Dict[str, Any]:
@@ -562,12 +670,12 @@ def list_recent_invoices(limit: int = 5, location_id: Optional[str] = None) -> D
             "limit": limit
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = square_session.post(url, json=payload, headers=headers, timeout=10)
         data = response.json()
         
         if response.status_code == 200:
             return {"success": True, "invoices": data.get("invoices", [])}
         return {"success": False, "error": str(data.get("errors", "Unknown error"))}
     except Exception as e:
-        logger.error(f"Error listing recent invoices: {str(e)}")
+        logger.error("Error listing recent invoices: %s", e)
         return {"success": False, "error": str(e)}